@@ -0,0 +1,103 @@
+import json
+import os
+import time
+
+
+class ThresholdRule:
+    """Fires when a vital leaves [low, high]; clears only once it is back inside by clear_margin"""
+    __slots__ = ("field", "alert_type", "low", "high", "clear_margin")
+
+    def __init__(self, field, alert_type, low=None, high=None, clear_margin=0.0):
+        self.field = field
+        self.alert_type = alert_type
+        self.low = low
+        self.high = high
+        self.clear_margin = clear_margin
+
+    def breached(self, value) -> bool:
+        return (self.high is not None and value > self.high) or (self.low is not None and value < self.low)
+
+    def cleared(self, value) -> bool:
+        if self.high is not None and value > self.high - self.clear_margin:
+            return False
+        if self.low is not None and value < self.low + self.clear_margin:
+            return False
+        return True
+
+    def threshold_for(self, value):
+        return self.high if self.high is not None and value > self.high else self.low
+
+
+DEFAULT_RULES = [
+    ThresholdRule("heart_rate", "critical_heart_rate", low=50, high=120, clear_margin=5),
+    ThresholdRule("oxygen_level", "critical_oxygen_level", low=90, clear_margin=2),
+    ThresholdRule("temp", "critical_temp", low=35.0, high=38.5, clear_margin=0.3),
+]
+
+
+def load_rules() -> list:
+    """Rules from the ALERT_RULES env var (JSON list of rule kwargs), or the defaults"""
+    raw = os.getenv("ALERT_RULES")
+    if not raw:
+        return DEFAULT_RULES
+    return [ThresholdRule(**rule) for rule in json.loads(raw)]
+
+
+class PatientState:
+    __slots__ = ("active", "last_fired")
+
+    def __init__(self, rule_count: int):
+        self.active = 0  # kural başına bir bit
+        self.last_fired = [float("-inf")] * rule_count
+
+
+class ThresholdDetector:
+    """Per-patient threshold rules with hysteresis and a per-rule cooldown"""
+
+    def __init__(self, rules=None, cooldown_seconds: float = 60.0):
+        self.rules = rules if rules is not None else load_rules()
+        self.cooldown_seconds = cooldown_seconds
+        self._states = {}
+        self.packets = 0
+        self.alerts_fired = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def observe(self, patient_id, vitals: dict, now: float = None) -> list:
+        """Feed one packet; returns (rule, value) pairs that should raise an alert"""
+        now = time.monotonic() if now is None else now
+        state = self._states.get(patient_id)
+        if state is None:
+            state = self._states[patient_id] = PatientState(len(self.rules))
+
+        fired = []
+        for i, rule in enumerate(self.rules):
+            value = vitals.get(rule.field)
+            if value is None:
+                continue
+            bit = 1 << i
+            if state.active & bit:
+                if rule.cleared(value):
+                    state.active &= ~bit
+            elif rule.breached(value):
+                state.active |= bit
+                if now - state.last_fired[i] >= self.cooldown_seconds:
+                    state.last_fired[i] = now
+                    fired.append((rule, value))
+        self.alerts_fired += len(fired)
+        return fired
+
+    def record_cost(self, elapsed_ns: int):
+        self.packets += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+
+    def stats(self) -> dict:
+        return {
+            "patients": len(self._states),
+            "packets": self.packets,
+            "alerts_fired": self.alerts_fired,
+            "avg_us": round(self.total_ns / self.packets / 1000, 2) if self.packets else 0.0,
+            "max_us": round(self.max_ns / 1000, 2)
+        }
@@ -0,0 +1,150 @@
+import datetime
+import math
+from array import array
+from collections import deque
+
+FIELDS = ("heart_rate", "oxygen_level", "temp")
+# Alan başına tutulan toplamlar: ewma, sum, sumsq, sumxy
+_EWMA, _SUM, _SUMSQ, _SUMXY = range(4)
+_STATS_PER_FIELD = 4
+
+
+class PatientWindow:
+    """Fixed-size float32 ring buffer per vital plus running sums for O(1) updates"""
+    __slots__ = ("values", "sums", "count", "head")
+
+    def __init__(self, window: int):
+        self.values = array("f", bytes(4 * window * len(FIELDS)))
+        self.sums = array("d", bytes(8 * _STATS_PER_FIELD * len(FIELDS)))
+        self.count = 0
+        self.head = 0
+
+
+class AnomalyTracker:
+    """Rolling EWMA, mean, std, z-score and trend slope per patient and vital"""
+
+    def __init__(self, window: int = 60, alpha: float = 0.1, z_threshold: float = 3.0,
+                 min_samples: int = 20, history: int = 1000):
+        self.window = window
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.min_samples = min_samples
+        self.anomalies = deque(maxlen=history)
+        self._patients = {}
+
+    def update(self, patient_id, vitals: dict) -> list:
+        """Add one packet; returns the anomalies it triggered.
+
+        Packets missing a vital (or with a non-numeric one) are skipped whole: all vitals share
+        one head and count, so advancing only some of the ring buffers would desynchronize them.
+        """
+        values = [vitals.get(field) for field in FIELDS]
+        if any(isinstance(raw, bool) or not isinstance(raw, (int, float)) for raw in values):
+            return []
+        state = self._patients.get(patient_id)
+        if state is None:
+            state = self._patients[patient_id] = PatientWindow(self.window)
+
+        w = self.window
+        n = state.count
+        found = []
+        for f, field in enumerate(FIELDS):
+            raw = values[f]
+            base = f * _STATS_PER_FIELD
+            sums = state.sums
+            slot = f * w + state.head
+            old_sum = sums[base + _SUM]
+
+            # z-score yeni değer pencereye girmeden önceki istatistiklere göre hesaplanır
+            if n >= self.min_samples:
+                mean = old_sum / n
+                variance = max(sums[base + _SUMSQ] / n - mean * mean, 0.0)
+                std = math.sqrt(variance)
+                if std > 1e-6:
+                    z = (raw - mean) / std
+                    if abs(z) >= self.z_threshold:
+                        found.append({
+                            "patient_id": patient_id,
+                            "field": field,
+                            "value": raw,
+                            "z_score": round(z, 2),
+                            "mean": round(mean, 2),
+                            "std": round(std, 3),
+                            "ewma": round(sums[base + _EWMA], 2),
+                            "timestamp": vitals.get("timestamp") or datetime.datetime.now(datetime.timezone.utc).isoformat()
+                        })
+
+            if n == w:
+                oldest = state.values[slot]
+                sums[base + _SUMXY] += -(old_sum - oldest) + (w - 1) * raw
+                sums[base + _SUM] += raw - oldest
+                sums[base + _SUMSQ] += raw * raw - oldest * oldest
+            else:
+                sums[base + _SUMXY] += n * raw
+                sums[base + _SUM] += raw
+                sums[base + _SUMSQ] += raw * raw
+            state.values[slot] = raw
+            sums[base + _EWMA] = raw if n == 0 else self.alpha * raw + (1 - self.alpha) * sums[base + _EWMA]
+
+        state.count = min(n + 1, w)
+        state.head = (state.head + 1) % w
+        if state.head == 0:
+            # Her tam turda toplamları tampondan yeniden hesapla (kayan nokta birikimine karşı)
+            self._recompute(state)
+
+        for anomaly in found:
+            anomaly["slope"] = self.snapshot(patient_id)[anomaly["field"]]["slope"]
+            self.anomalies.append(anomaly)
+        return found
+
+    def _recompute(self, state: PatientWindow):
+        w = self.window
+        for f in range(len(FIELDS)):
+            base = f * _STATS_PER_FIELD
+            total = sumsq = sumxy = 0.0
+            # head == 0 iken en eski değer 0. indekstedir
+            for x in range(state.count):
+                y = state.values[f * w + x]
+                total += y
+                sumsq += y * y
+                sumxy += x * y
+            state.sums[base + _SUM] = total
+            state.sums[base + _SUMSQ] = sumsq
+            state.sums[base + _SUMXY] = sumxy
+
+    def snapshot(self, patient_id) -> dict:
+        """Current rolling statistics for a patient, or an empty dict if unknown"""
+        state = self._patients.get(patient_id)
+        if state is None or state.count == 0:
+            return {}
+        n = state.count
+        sum_x = n * (n - 1) / 2
+        sum_xx = (n - 1) * n * (2 * n - 1) / 6
+        denominator = n * sum_xx - sum_x * sum_x
+        result = {"samples": n}
+        for f, field in enumerate(FIELDS):
+            base = f * _STATS_PER_FIELD
+            mean = state.sums[base + _SUM] / n
+            variance = max(state.sums[base + _SUMSQ] / n - mean * mean, 0.0)
+            slope = 0.0
+            if denominator:
+                slope = (n * state.sums[base + _SUMXY] - sum_x * state.sums[base + _SUM]) / denominator
+            result[field] = {
+                "ewma": round(state.sums[base + _EWMA], 2),
+                "mean": round(mean, 2),
+                "std": round(math.sqrt(variance), 3),
+                "slope": round(slope, 4)
+            }
+        return result
+
+    def recent(self, patient_id=None, limit: int = 50) -> list:
+        result = []
+        for anomaly in reversed(self.anomalies):
+            if patient_id is None or anomaly["patient_id"] == patient_id:
+                result.append(anomaly)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def patient_count(self) -> int:
+        return len(self._patients)
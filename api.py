@@ -1,13 +1,27 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response, Depends, Header
+from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
+from uuid import UUID
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
 import time
+import base64
+import json
+import asyncio
 from databases import Database
-from crypto_utils import decrypt_data
+from crypto_utils import decrypt_data, decrypt_vitals, envelope_version, ENVELOPE_V2
+from cache_utils import LRUCache, TTLCache
+from vitals_broker import Broker, SHED
+from pg_listener import PgListener
+from vitals_archive import read_archive
+from alert_detector import ThresholdDetector
+from anomaly_stats import AnomalyTracker
+from auth_tokens import KeyRing, TokenError, issue_token, verify_token
+from db_pool import DbPool, PoolTimeout
+import fast_json
 import asyncpg
 from fastapi import status
 from fastapi import Request
@@ -25,20 +39,157 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Async DB connection
 DATABASE_URL = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
-database = Database(DATABASE_URL)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+database = Database(DATABASE_URL, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE)
+
+# Sabit sıcak sorgular ayrı bir asyncpg havuzunda hazırlanmış ifade olarak tekrar kullanılır
+db_pool = DbPool(
+    DATABASE_URL,
+    min_size=int(os.getenv("DB_HOT_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("DB_HOT_POOL_MAX_SIZE", "10")),
+    acquire_timeout=float(os.getenv("DB_ACQUIRE_TIMEOUT", "5")),
+    statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+)
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
 
 @app.on_event("startup")
 async def startup():
     await database.connect()
+    await db_pool.connect()
+    if VITALS_FANOUT == "notify":
+        await listener.start()
 
 @app.on_event("shutdown")
 async def shutdown():
+    await listener.stop()
+    await db_pool.close()
     await database.disconnect()
 
+# Signed session tokens
+# /login bir token verir; token gönderen istekler rol/ACL için veritabanına gitmez.
+# Token'daki hasta listesi süresi dolana kadar geçerlidir, bu yüzden TTL kısa tutulur.
+AUTH_TOKEN_TTL_SECONDS = int(os.getenv("AUTH_TOKEN_TTL_SECONDS", "900"))
+keyring = KeyRing(os.getenv("AUTH_KEYS_FILE"), os.getenv("AUTH_SECRET"))
+
+class Session:
+    __slots__ = ("user_id", "role", "patient_ids")
+
+    def __init__(self, user_id: int, role: str, patient_ids: frozenset):
+        self.user_id = user_id
+        self.role = role
+        self.patient_ids = patient_ids
+
+def optional_session(authorization: Optional[str] = Header(None)) -> Optional[Session]:
+    """Verify a bearer token if one was sent; requests without one fall back to query params"""
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Expected a Bearer token")
+    try:
+        claims = verify_token(keyring, token)
+    except TokenError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    return Session(int(claims["sub"]), claims["role"], frozenset(claims.get("patients", ())))
+
+def require_identity(session: Optional[Session], user_id: int, role: str):
+    """A token pins the caller, so query params naming someone else are rejected"""
+    if session is not None and (session.user_id != user_id or session.role != role):
+        raise HTTPException(status_code=403, detail="Token does not match user_id/role")
+
+# Yeni paketleri canlı akış istemcilerine dağıtan süreç içi broker
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "100"))
+STREAM_KEEPALIVE_SECONDS = 15
+broker = Broker(queue_size=STREAM_QUEUE_SIZE)
+
+# Birden fazla worker varken olaylar Postgres LISTEN/NOTIFY ile tüm süreçlere yayılır ("local": sadece bu süreç)
+VITALS_FANOUT = os.getenv("VITALS_FANOUT", "notify")
+PACKET_CHANNEL = "new_packet"
+ALERT_CHANNEL = "new_critical_alert"
+ACL_CHANNEL = "acl_changed"
+CHAT_CHANNEL = "new_chat_message"
+# NOTIFY payload sınırı 8000 byte; sığmayan olayların büyük alanı boş gönderilir ve listener tarafında okunur
+MAX_NOTIFY_PAYLOAD = 7900
+BULKY_EVENT_FIELDS = {PACKET_CHANNEL: "encrypted_data", CHAT_CHANNEL: "content"}
+
+def packet_event(data, inserted_time) -> dict:
+    return {
+        "uuid": data.uuid,
+        "seq_no": data.seq_no,
+        "patient_id": data.patient_id,
+        "encrypted_data": data.encrypted_data,
+        "time": inserted_time,
+        "late": data.late
+    }
+
+async def on_packet_event(event: dict):
+    """Publish a stored packet to its patient topic and to the all-patients topic"""
+    if event.get("encrypted_data") is None:
+        row = await database.fetch_one(
+            f"SELECT {ENCRYPTED_DATA_SQL} FROM encrypted_vitals WHERE uuid = :uuid",
+            {"uuid": event["uuid"]}
+        )
+        if not row:
+            return
+        event["encrypted_data"] = row["encrypted_data"]
+    broker.publish(f"vitals:{event['patient_id']}", event)
+    broker.publish("vitals:*", event)
+
+async def on_alert_event(event: dict):
+    for caregiver_id in event["caregiver_ids"]:
+        broker.publish(f"alerts:{caregiver_id}", event)
+
+async def on_acl_event(event: dict):
+    acl_cache.pop(event["caregiver_id"])
+
+async def on_chat_event(event: dict):
+    """Publish a new chat message to the subscribers of its note"""
+    if event.get("content") is None:
+        row = await database.fetch_one("SELECT content FROM chat_messages WHERE id = :id", {"id": event["id"]})
+        if not row:
+            return
+        event["content"] = row["content"]
+    broker.publish(f"chat:{event['note_id']}", event)
+
+EVENT_HANDLERS = {
+    PACKET_CHANNEL: on_packet_event,
+    ALERT_CHANNEL: on_alert_event,
+    ACL_CHANNEL: on_acl_event,
+    CHAT_CHANNEL: on_chat_event
+}
+listener = PgListener(DATABASE_URL, EVENT_HANDLERS)
+
+async def announce(channel: str, events: list):
+    """Fan events out to every worker via pg_notify, or to this worker only if LISTEN is unavailable"""
+    if not events:
+        return
+    if VITALS_FANOUT == "notify" and listener.connected:
+        payloads = []
+        for event in events:
+            payload = fast_json.dumps(event)
+            if len(payload.encode("utf-8")) > MAX_NOTIFY_PAYLOAD:
+                payload = fast_json.dumps({**event, BULKY_EVENT_FIELDS[channel]: None})
+            payloads.append(payload)
+        try:
+            await database.execute(
+                "SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload",
+                {"channel": channel, "payloads": payloads}
+            )
+            return
+        except Exception as e:
+            print(f"pg_notify on {channel} failed, publishing locally: {e}")
+    for event in events:
+        await EVENT_HANDLERS[channel](event)
+
 # Data model
 class VitalsIn(BaseModel):
     patient_id: str
@@ -77,81 +228,401 @@ async def write_vitals(vitals: VitalsIn):
 
 
 
+# id ve time (NOW()) commit sırasına göre artmaz: daha küçük id'li bir işlem, daha büyük id
+# okunduktan sonra commit edilebilir ve imleç onu atlar. rollup_worker gibi, imleçli okumalar da
+# sadece CURSOR_LAG_SECONDS'tan eski satırları döndürür; bu sürede commit edilen satırlar kaybolmaz
+CURSOR_LAG_SECONDS = float(os.getenv("CURSOR_LAG_SECONDS", "5"))
+
+def keyset_filter(table: str, after_id: Optional[int], after_time: Optional[datetime], values: dict):
+    """WHERE condition and ORDER BY for an oldest-first read that resumes after a cursor.
+
+    Rows newer than CURSOR_LAG_SECONDS are held back so that late-committing inserts are not skipped.
+    """
+    values["cursor_lag"] = CURSOR_LAG_SECONDS
+    if after_time is not None:
+        # Aynı zaman damgalı satırlar id ile ayrılır
+        values["after_time"] = after_time
+        values["after_id"] = after_id or 0
+        return (
+            "(time, id) > (:after_time, :after_id) AND time < NOW() - make_interval(secs => :cursor_lag)",
+            "time ASC, id ASC"
+        )
+    values["after_id"] = after_id
+    # id sırasında ilk yerleşmemiş satırda durulur; ondan büyük id'ler bir sonraki okumaya kalır
+    return f"""id > :after_id AND id < COALESCE((
+            SELECT min(id) FROM {table}
+            WHERE id > :after_id AND time >= NOW() - make_interval(secs => :cursor_lag)
+        ), 9223372036854775807)""", "id ASC"
+
+def next_cursor(rows, after_id: Optional[int], after_time: Optional[datetime]) -> dict:
+    """Cursor to pass on the next poll; unchanged when no new rows arrived"""
+    if after_time is not None:
+        if not rows:
+            return {"after_time": after_time, "after_id": after_id or 0}
+        return {"after_time": rows[-1]["time"], "after_id": rows[-1]["id"]}
+    return {"after_id": rows[-1]["id"] if rows else after_id}
+
+async def stream_list(query: str, values: dict, incremental: bool, after_id: Optional[int], after_time: Optional[datetime]):
+    """stream=true path of the vitals reads: same body as the list/cursor responses, serialized by Postgres"""
+    try:
+        if not incremental:
+            return await fast_json.stream_rows(database, query, values)
+        return await fast_json.stream_rows(
+            database, query, values,
+            prefix='{"rows":[',
+            suffix=lambda count, last: f'],"next_cursor":{fast_json.dumps(next_cursor([last] if last else [], after_id, after_time))}}}',
+            track=("id", "time")
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/read")
-async def read_vitals(patient_id: Optional[str] = None, user_id: Optional[int] = None, role: Optional[str] = None, limit: int = 10):
+async def read_vitals(
+    patient_id: Optional[str] = None,
+    user_id: Optional[int] = None,
+    role: Optional[str] = None,
+    limit: int = 10,
+    after_id: Optional[int] = None,
+    after_time: Optional[datetime] = None,
+    stream: bool = False
+):
+    where = []
+    values = {"limit": limit}
     if role == "doctor":
         # Doktor herkesi görebilir
-        query = """
-            SELECT * FROM vitals
-            ORDER BY time DESC
-            LIMIT :limit
-        """
-        values = {"limit": limit}
+        pass
     elif role == "patient" and user_id:
         # Hasta sadece kendisini görür
-        query = """
-            SELECT * FROM vitals
-            WHERE patient_id = :patient_id
-            ORDER BY time DESC
-            LIMIT :limit
-        """
-        values = {"patient_id": str(user_id), "limit": limit}
+        where.append("patient_id = :patient_id")
+        values["patient_id"] = str(user_id)
     else:
         raise HTTPException(status_code=403, detail="Unauthorized or missing parameters")
 
+    # Cursor verilirse sadece yeni satırlar eskiden yeniye döner
+    incremental = after_id is not None or after_time is not None
+    order = "time DESC"
+    if incremental:
+        condition, order = keyset_filter("vitals", after_id, after_time, values)
+        where.append(condition)
+
+    query = f"""
+        SELECT * FROM vitals
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {order}
+        LIMIT :limit
+    """
+    if stream:
+        return await stream_list(query, values, incremental, after_id, after_time)
     try:
         result = await database.fetch_all(query=query, values=values)
-        return result
+        if incremental:
+            return fast_json.FastJSONResponse({"rows": result, "next_cursor": next_cursor(result, after_id, after_time)})
+        return fast_json.FastJSONResponse(result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 
 
-@app.post("/write_encrypted")
-async def write_encrypted(data: EncryptedDataIn):
-    query = """
-        INSERT INTO encrypted_vitals (uuid, seq_no, patient_id, encrypted_data, time, late)
-        VALUES (:uuid, :seq_no, :patient_id, :encrypted_data, NOW(), :late)
-        RETURNING time
-    """
+# v2 paketler BYTEA kolonunda tutulur; istemcilere her iki format da base64 metin olarak döner
+ENCRYPTED_DATA_SQL = "COALESCE(encrypted_data, replace(encode(envelope, 'base64'), chr(10), '')) AS encrypted_data"
+
+def packet_values(data: EncryptedDataIn) -> dict:
+    """Map an incoming packet to insert values; v2 envelopes are stored as raw bytes"""
     values = {
-        "uuid": data.uuid,
+        "uuid": str(UUID(data.uuid)),
         "seq_no": data.seq_no,
         "patient_id": data.patient_id,
         "encrypted_data": data.encrypted_data,
+        "envelope": None,
         "late": data.late
     }
+    if envelope_version(data.encrypted_data) == ENVELOPE_V2:
+        values["encrypted_data"] = None
+        values["envelope"] = base64.b64decode(data.encrypted_data)
+    return values
+
+# Tekrar kontrolü packet_keys üzerinden yapılır: hypertable'daki unique indeksler time kolonunu içermek zorunda
+# Paket kolonları dizi olarak gönderilir: SQL metni batch boyutundan bağımsız, tek bir hazırlanmış ifade
+INSERT_PACKETS_SQL = """
+    WITH packet AS (
+        SELECT * FROM unnest($1::uuid[], $2::bigint[], $3::varchar[], $4::text[], $5::bytea[], $6::boolean[])
+            AS p (uuid, seq_no, patient_id, encrypted_data, envelope, late)
+    ), new_key AS (
+        INSERT INTO packet_keys (uuid, patient_id, seq_no)
+        SELECT uuid, patient_id, seq_no FROM packet
+        ON CONFLICT DO NOTHING
+        RETURNING uuid
+    )
+    INSERT INTO encrypted_vitals (uuid, seq_no, patient_id, encrypted_data, envelope, time, late)
+    SELECT p.uuid, p.seq_no, p.patient_id, p.encrypted_data, p.envelope, NOW(), p.late
+    FROM packet p JOIN new_key k ON k.uuid = p.uuid
+    RETURNING uuid, time
+"""
+db_pool.register("insert_packets", INSERT_PACKETS_SQL)
+
+async def insert_packets(packets: list) -> dict:
+    """Insert packet_values() dicts in one statement; returns {uuid: time} for rows that were new"""
+    columns = ("uuid", "seq_no", "patient_id", "encrypted_data", "envelope", "late")
+    stored = await db_pool.fetch("insert_packets", *([packet[column] for packet in packets] for column in columns))
+    return {str(row["uuid"]): row["time"] for row in stored}
+
+# Eşik kontrolü ingest sırasında yapılır: hiçbir telefon izlemese de alert üretilir.
+# Dedektör ve anomali durumu süreç içidir: tek worker ile çalıştırılmalıdır. Birden fazla worker'da
+# her biri hastanın paketlerinin sadece bir kısmını görür (histerezis ve z-score pencereleri bölünür)
+INGEST_DETECTION = os.getenv("INGEST_DETECTION", "1") == "1"
+ALERT_COOLDOWN_SECONDS = float(os.getenv("ALERT_COOLDOWN_SECONDS", "60"))
+detector = ThresholdDetector(cooldown_seconds=ALERT_COOLDOWN_SECONDS)
+# Hasta başına sabit boyutlu halka tamponlarda kayan istatistikler
+anomaly_tracker = AnomalyTracker(
+    window=int(os.getenv("ANOMALY_WINDOW", "60")),
+    z_threshold=float(os.getenv("ANOMALY_Z_THRESHOLD", "3.0"))
+)
+
+async def detect_on_ingest(packets: list):
+    """Decrypt newly stored packets, run the threshold rules and raise alerts for new breaches"""
+    if not INGEST_DETECTION:
+        return
+    # Geç gelen (kuyruktan tekrar gönderilen) paketler eski ölçümlerdir; durum makinesine ve kayan
+    # pencereye girerlerse sırayı bozarlar. Batch içinde de sıra seq_no ile korunur
+    for packet in sorted((p for p in packets if not p["late"]), key=lambda p: p["seq_no"]):
+        start = time.perf_counter_ns()
+        try:
+            vitals = decrypt_vitals(packet["envelope"] or packet["encrypted_data"])
+        except Exception as e:
+            print(f"Detector could not decrypt {packet['uuid']}: {e}")
+            continue
+        fired = detector.observe(packet["patient_id"], vitals)
+        anomaly_tracker.update(packet["patient_id"], vitals)
+        detector.record_cost(time.perf_counter_ns() - start)
+        # Çözülmüş paket okuma yolunda tekrar çözülmesin
+        decrypted_cache.put(packet["uuid"], vitals)
+
+        for rule, value in fired:
+            threshold = rule.threshold_for(value)
+            try:
+                await fan_out_critical_alert(
+                    int(packet["patient_id"]),
+                    rule.alert_type,
+                    int(vitals.get("heart_rate") or 0),
+                    threshold,
+                    f"Hasta {packet['patient_id']} kritik {rule.field} seviyesinde! Değer: {value}, Eşik: {threshold}"
+                )
+            except Exception as e:
+                print(f"Detector could not raise {rule.alert_type} for patient {packet['patient_id']}: {e}")
+
+@app.get("/detector/stats")
+async def detector_stats():
+    return {
+        "enabled": INGEST_DETECTION,
+        "scope": "worker",
+        "pid": os.getpid(),
+        "anomaly_patients": anomaly_tracker.patient_count(),
+        **detector.stats()
+    }
+
+@app.get("/vitals/anomalies")
+async def read_vitals_anomalies(patient_id: Optional[str] = None, limit: int = 50):
+    """Recent z-score anomalies, newest first, with the patient's current rolling statistics.
+
+    The state lives in this worker only (scope "worker"), so the API should run as a single worker.
+    """
+    result = {"scope": "worker", "pid": os.getpid(), "anomalies": anomaly_tracker.recent(patient_id, limit)}
+    if patient_id is not None:
+        result["current"] = anomaly_tracker.snapshot(patient_id)
+    return result
+
+@app.post("/write_encrypted")
+async def write_encrypted(data: EncryptedDataIn):
     try:
-        result = await database.fetch_one(query=query, values=values)
-        return {
-            "message": "Encrypted data inserted",
-            "uuid": data.uuid,
-            "seq_no": data.seq_no,
-            "time": result["time"] if result else None
-        }
+        values = packet_values(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid packet: {str(e)}")
+    try:
+        stored = await insert_packets([values])
+    except PoolTimeout:
+        raise
     except Exception as e:
-        if "duplicate key" in str(e).lower():
-            return {"message": "Duplicate packet", "uuid": data.uuid}
         raise HTTPException(status_code=500, detail=str(e))
+    if values["uuid"] not in stored:
+        return {"message": "Duplicate packet", "uuid": data.uuid}
+    await announce(PACKET_CHANNEL, [packet_event(data, stored[values["uuid"]])])
+    await detect_on_ingest([values])
+    return {
+        "message": "Encrypted data inserted",
+        "uuid": data.uuid,
+        "seq_no": data.seq_no,
+        "time": stored[values["uuid"]]
+    }
+
+# Tek istekte kabul edilen en fazla paket sayısı; insert unnest dizileriyle yapıldığından
+# parametre limiti değil istek boyutu ve tek ifadenin süresi sınırlar
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+
+def validate_packet(data: EncryptedDataIn):
+    """Return a rejection reason for a malformed packet, or None if it can be stored"""
+    try:
+        UUID(data.uuid)
+    except ValueError:
+        return "invalid uuid"
+    if not data.patient_id:
+        return "missing patient_id"
+    if data.seq_no < 0:
+        return "negative seq_no"
+    if not data.encrypted_data:
+        return "empty encrypted_data"
+    return None
+
+@app.post("/write_encrypted_batch")
+async def write_encrypted_batch(packets: List[EncryptedDataIn]):
+    """Store many encrypted packets with a single multi-row INSERT"""
+    if len(packets) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} packets")
+
+    results = [None] * len(packets)
+    seen_uuids = set()
+    seen_seqs = set()
+    accepted = []
+
+    # Hatalı paketleri ve batch içindeki tekrarları DB'ye gitmeden ayıkla
+    for i, data in enumerate(packets):
+        reason = validate_packet(data)
+        if reason is None:
+            try:
+                packet = packet_values(data)
+            except ValueError:
+                reason = "invalid envelope encoding"
+        if reason:
+            results[i] = {"uuid": data.uuid, "seq_no": data.seq_no, "status": "rejected", "detail": reason}
+            continue
+        key = str(UUID(data.uuid))
+        if key in seen_uuids or (data.patient_id, data.seq_no) in seen_seqs:
+            results[i] = {"uuid": data.uuid, "seq_no": data.seq_no, "status": "duplicate"}
+            continue
+        seen_uuids.add(key)
+        seen_seqs.add((data.patient_id, data.seq_no))
+        accepted.append((i, key, data, packet))
+
+    inserted = {}
+    if accepted:
+        # uuid veya (patient_id, seq_no) çakışması olan satırlar sessizce atlanır
+        try:
+            inserted = await insert_packets([packet for _, _, _, packet in accepted])
+        except PoolTimeout:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    events = []
+    new_packets = []
+    for i, key, data, packet in accepted:
+        if key in inserted:
+            events.append(packet_event(data, inserted[key]))
+            new_packets.append(packet)
+            results[i] = {"uuid": data.uuid, "seq_no": data.seq_no, "status": "inserted", "time": inserted[key]}
+        else:
+            results[i] = {"uuid": data.uuid, "seq_no": data.seq_no, "status": "duplicate"}
+
+    await announce(PACKET_CHANNEL, events)
+    await detect_on_ingest(new_packets)
+
+    counts = {"inserted": 0, "duplicate": 0, "rejected": 0}
+    for result in results:
+        counts[result["status"]] += 1
+
+    return {
+        "message": "Encrypted batch processed",
+        "inserted": counts["inserted"],
+        "duplicates": counts["duplicate"],
+        "rejected": counts["rejected"],
+        "results": results
+    }
+
+# Filtresiz "son N paket" okumaları en sık çağrılan okuma yolu
+db_pool.register("latest_packets", f"""
+    SELECT id, uuid, seq_no, patient_id, {ENCRYPTED_DATA_SQL}, time
+    FROM encrypted_vitals
+    ORDER BY time DESC, id DESC
+    LIMIT $1
+""")
+db_pool.register("latest_patient_packets", f"""
+    SELECT id, uuid, seq_no, patient_id, {ENCRYPTED_DATA_SQL}, time
+    FROM encrypted_vitals
+    WHERE patient_id = $1
+    ORDER BY time DESC, id DESC
+    LIMIT $2
+""")
 
 @app.get("/read_encrypted")
-async def read_encrypted(limit: int = 10):
-    query = """
-        SELECT uuid, seq_no, patient_id, encrypted_data, time
+async def read_encrypted(
+    limit: int = 10,
+    after_id: Optional[int] = None,
+    after_time: Optional[datetime] = None,
+    patient_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    stream: bool = False
+):
+    incremental = after_id is not None or after_time is not None
+    if start is None and end is None and not incremental and not stream:
+        if patient_id is None:
+            rows = await db_pool.fetch("latest_packets", limit)
+        else:
+            rows = await db_pool.fetch("latest_patient_packets", patient_id, limit)
+        return fast_json.FastJSONResponse(rows)
+
+    where = []
+    values = {"limit": limit}
+    # Hasta filtresi (patient_id, time DESC, id DESC) indeksini kullanır
+    if patient_id is not None:
+        where.append("patient_id = :patient_id")
+        values["patient_id"] = patient_id
+    if start is not None:
+        where.append("time >= :start")
+        values["start"] = start
+    if end is not None:
+        where.append("time <= :end")
+        values["end"] = end
+
+    order = "time DESC, id DESC"
+    if incremental:
+        condition, order = keyset_filter("encrypted_vitals", after_id, after_time, values)
+        where.append(condition)
+
+    query = f"""
+        SELECT id, uuid, seq_no, patient_id, {ENCRYPTED_DATA_SQL}, time
         FROM encrypted_vitals
-        ORDER BY time DESC
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {order}
         LIMIT :limit
     """
-    values = {"limit": limit}
+    if stream:
+        return await stream_list(query, values, incremental, after_id, after_time)
     try:
         result = await database.fetch_all(query=query, values=values)
-        return result
+        if incremental:
+            return fast_json.FastJSONResponse({"rows": result, "next_cursor": next_cursor(result, after_id, after_time)})
+        return fast_json.FastJSONResponse(result)
+    except PoolTimeout:
+        raise
     except Exception as e:
         import traceback
         print("/read_encrypted error:", traceback.format_exc())
         return {"error": str(e), "trace": traceback.format_exc()}
 
+@app.get("/read_encrypted/archive")
+async def read_encrypted_archive(
+    patient_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 100
+):
+    """Read packets that vitals_archive.py moved out of the database, oldest first"""
+    try:
+        return await asyncio.to_thread(read_archive, patient_id, start, end, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 class EncryptedDataOnly(BaseModel):
     encrypted_data: str
 
@@ -163,39 +634,245 @@ async def decrypt_endpoint(data: EncryptedDataOnly):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Decryption failed: {str(e)}")
 
+class DecryptBatchIn(BaseModel):
+    encrypted_data: List[str]
+
+@app.post("/decrypt_batch")
+async def decrypt_batch(data: DecryptBatchIn):
+    """Decrypt many packets in one request; failures are reported per item"""
+    if len(data.encrypted_data) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} packets")
+
+    results = []
+    failed = 0
+    for i, enc in enumerate(data.encrypted_data):
+        try:
+            results.append({"index": i, "vitals": decrypt_vitals(enc)})
+        except Exception as e:
+            failed += 1
+            results.append({"index": i, "error": f"Decryption failed: {str(e)}"})
+
+    return {
+        "decrypted": len(results) - failed,
+        "failed": failed,
+        "results": results
+    }
+
+# Çözülmüş paketler uuid ile önbelleğe alınır; her ciphertext süreç başına en fazla bir kez çözülür
+DECRYPT_CACHE_SIZE = int(os.getenv("DECRYPT_CACHE_SIZE", "10000"))
+decrypted_cache = LRUCache(DECRYPT_CACHE_SIZE)
+
+@app.get("/vitals/decrypted")
+async def read_decrypted_vitals(
+    patient_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 10
+):
+    """Return plaintext vitals for a patient, decrypting only rows not in the cache"""
+    where = ["patient_id = :patient_id"]
+    values = {"patient_id": patient_id, "limit": limit}
+    if start is not None:
+        where.append("time >= :start")
+        values["start"] = start
+    if end is not None:
+        where.append("time <= :end")
+        values["end"] = end
+
+    # Önce sadece metadata çekilir; ciphertext yalnızca cache'te olmayan satırlar için okunur
+    meta_query = f"""
+        SELECT uuid, seq_no, patient_id, time
+        FROM encrypted_vitals
+        WHERE {' AND '.join(where)}
+        ORDER BY time DESC
+        LIMIT :limit
+    """
+    try:
+        rows = await database.fetch_all(query=meta_query, values=values)
+
+        vitals_by_uuid = {}
+        missing = []
+        for row in rows:
+            key = str(row["uuid"])
+            cached = decrypted_cache.get(key)
+            if cached is None:
+                missing.append(key)
+            else:
+                vitals_by_uuid[key] = cached
+
+        if missing:
+            data_query = """
+                SELECT uuid, encrypted_data, envelope FROM encrypted_vitals
+                WHERE uuid = ANY(:uuids)
+            """
+            for row in await database.fetch_all(query=data_query, values={"uuids": missing}):
+                key = str(row["uuid"])
+                try:
+                    vitals = decrypt_vitals(row["envelope"] or row["encrypted_data"])
+                except Exception as e:
+                    print(f"/vitals/decrypted could not decrypt {key}: {e}")
+                    continue
+                decrypted_cache.put(key, vitals)
+                vitals_by_uuid[key] = vitals
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    result = []
+    for row in rows:
+        vitals = vitals_by_uuid.get(str(row["uuid"]))
+        if vitals is None:
+            continue
+        result.append({
+            "uuid": str(row["uuid"]),
+            "seq_no": row["seq_no"],
+            "patient_id": row["patient_id"],
+            "time": row["time"],
+            "heart_rate": vitals.get("heart_rate"),
+            "oxygen_level": vitals.get("oxygen_level"),
+            "temp": vitals.get("temp"),
+            "timestamp": vitals.get("timestamp")
+        })
+    return result
+
+@app.get("/vitals/summary")
+async def read_vitals_summary(
+    patient_id: str,
+    bucket: str = "minute",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 1440
+):
+    """Per-minute or per-hour aggregates maintained by rollup_worker.py, oldest first"""
+    if bucket not in ("minute", "hour"):
+        raise HTTPException(status_code=400, detail="bucket must be 'minute' or 'hour'")
+
+    where = ["patient_id = :patient_id", "bucket_size = :bucket_size"]
+    values = {"patient_id": patient_id, "bucket_size": bucket, "limit": limit}
+    if start is not None:
+        where.append("bucket >= :start")
+        values["start"] = start
+    if end is not None:
+        where.append("bucket <= :end")
+        values["end"] = end
+
+    # En yeni `limit` kova alınır, grafik için eskiden yeniye sıralanır
+    query = f"""
+        SELECT * FROM (
+            SELECT
+                bucket, sample_count,
+                heart_rate_min, heart_rate_max, heart_rate_sum::float / sample_count AS heart_rate_mean,
+                oxygen_level_min, oxygen_level_max, oxygen_level_sum::float / sample_count AS oxygen_level_mean,
+                temp_min, temp_max, temp_sum / sample_count AS temp_mean
+            FROM vitals_rollup
+            WHERE {' AND '.join(where)}
+            ORDER BY bucket DESC
+            LIMIT :limit
+        ) latest
+        ORDER BY bucket ASC
+    """
+    try:
+        return await database.fetch_all(query=query, values=values)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/vitals/decrypted/cache_stats")
+async def decrypted_cache_stats():
+    return decrypted_cache.stats()
+
 @app.post("/write_fallback")
 async def write_fallback(data: EncryptedDataIn):
-    query = """
-        INSERT INTO encrypted_vitals (uuid, seq_no, patient_id, encrypted_data, time, late)
-        VALUES (:uuid, :seq_no, :patient_id, :encrypted_data, NOW(), :late)
-        ON CONFLICT (uuid) DO NOTHING
-    """
     try:
-        await database.execute(query=query, values=data.dict())
-        return {"message": "Fallback write accepted"}
+        values = packet_values(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid packet: {str(e)}")
+    try:
+        stored = await insert_packets([values])
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if values["uuid"] in stored:
+        await announce(PACKET_CHANNEL, [packet_event(data, stored[values["uuid"]])])
+        await detect_on_ingest([values])
+    return {"message": "Fallback write accepted"}
+
+def sse_response(request: Request, topic: str, event_name: str):
+    """Stream broker events on a topic to the client as Server-Sent Events"""
+    queue = broker.subscribe(topic)
+
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is SHED:
+                    yield "event: shed\ndata: {}\n\n"
+                    break
+                yield f"event: {event_name}\ndata: {fast_json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(topic, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/stream/vitals")
+async def stream_vitals(request: Request, patient_id: Optional[str] = None):
+    """Server-Sent Events stream of newly stored packets, optionally for one patient"""
+    topic = f"vitals:{patient_id}" if patient_id else "vitals:*"
+    return sse_response(request, topic, "vitals")
+
+@app.get("/stream/critical_alerts")
+async def stream_critical_alerts(request: Request, caregiver_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
+    """Server-Sent Events stream of new critical alerts for a caregiver"""
+    require_identity(session, caregiver_id, role)
+    if role != 'caregiver':
+        raise HTTPException(status_code=403, detail="Only caregivers can receive alerts")
+    return sse_response(request, f"alerts:{caregiver_id}", "critical_alert")
+
+@app.get("/db/stats")
+async def db_stats():
+    """Hot-path pool saturation, acquire waits and per-statement latency"""
+    return db_pool.stats()
+
+@app.get("/stream/stats")
+async def stream_stats():
+    return {
+        **broker.stats(),
+        "fanout": VITALS_FANOUT,
+        "listener_connected": listener.connected,
+        "notifications_received": listener.received
+    }
 
 @app.get("/fetch_by_seq_range")
 async def fetch_by_seq_range(patient_id: str, start: int, end: int):
-    query = """
-        SELECT * FROM encrypted_vitals
+    query = f"""
+        SELECT id, uuid, seq_no, patient_id, {ENCRYPTED_DATA_SQL}, time, late
+        FROM encrypted_vitals
         WHERE patient_id = :pid AND seq_no BETWEEN :start AND :end
         ORDER BY seq_no
     """
     return await database.fetch_all(query=query, values={"pid": patient_id, "start": start, "end": end})
 
+db_pool.register("last_seq_nos", """
+    SELECT patient_id, MAX(seq_no) AS last_seq
+    FROM encrypted_vitals
+    GROUP BY patient_id
+""")
+
 @app.get("/get_last_seq_nos")
 async def get_last_seq_nos():
-    query = """
-        SELECT patient_id, MAX(seq_no) AS last_seq
-        FROM encrypted_vitals
-        GROUP BY patient_id
-    """
     try:
-        rows = await database.fetch_all(query)
+        rows = await db_pool.fetch("last_seq_nos")
         result = {row["patient_id"]: row["last_seq"] or 0 for row in rows}
         return result
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -273,6 +950,10 @@ async def login_user(data: LoginInput):
     user = await database.fetch_one(query=query, values={"email": email})
 
     if user and user["password"] == password:
+        claims = {"sub": str(user["id"]), "role": user["role"]}
+        if user["role"] == "caregiver":
+            claims["patients"] = sorted(await get_assigned_patient_ids(user["id"]))
+        token, expires_at = issue_token(keyring, claims, AUTH_TOKEN_TTL_SECONDS)
         return {
             "success": True,
             "message": "Login successful",
@@ -280,7 +961,9 @@ async def login_user(data: LoginInput):
             "user_id": user["id"],
             "role": user["role"],
             "first_name": user["first_name"],
-            "last_name": user["last_name"]
+            "last_name": user["last_name"],
+            "token": token,
+            "token_expires_at": expires_at
         }
     else:
         return {
@@ -292,49 +975,54 @@ async def login_user(data: LoginInput):
 
 
 @app.get("/get_patients")
-async def get_patients(user_id: int = None, role: str = None):
+async def get_patients(user_id: int = None, role: str = None, session: Optional[Session] = Depends(optional_session)):
+    if session is not None and user_id is None and role is None:
+        # Token tek başına yeterli; parametre verilmezse token'daki kimlik kullanılır
+        user_id, role = session.user_id, session.role
+    require_identity(session, user_id, role)
     if role == "caregiver" and user_id:
-        # Caregiver'a atanmış hasta id'lerini al
-        caregiver = await database.fetch_one(
-            "SELECT assigned_patients FROM users WHERE id = :id", {"id": user_id}
-        )
-        if not caregiver or not caregiver["assigned_patients"]:
-            return []
-
-        try:
-            ids = [int(i.strip()) for i in caregiver["assigned_patients"].split(",")]
-        except Exception as e:
-            raise HTTPException(status_code=400, detail="Invalid assigned_patients format")
-
+        # Caregiver'a atanmış hastalar
         query = """
-            SELECT id, email, first_name, last_name
-            FROM users
-            WHERE id = ANY(:ids)
+            SELECT u.id, u.email, u.first_name, u.last_name
+            FROM caregiver_patients cp
+            JOIN users u ON u.id = cp.patient_id
+            WHERE cp.caregiver_id = :id
+            ORDER BY u.id
         """
-        return await database.fetch_all(query, {"ids": ids})
+        return await database.fetch_all(query, {"id": user_id})
     
     else:
         query ="SELECT id, first_name, last_name FROM users WHERE role = 'patient'"
 
         return await database.fetch_all(query)
 
+# Caregiver -> atanmış hasta id'leri; atama değişince tüm worker'larda geçersiz kılınır
+ACL_CACHE_SIZE = int(os.getenv("ACL_CACHE_SIZE", "10000"))
+ACL_CACHE_TTL_SECONDS = float(os.getenv("ACL_CACHE_TTL_SECONDS", "60"))
+acl_cache = TTLCache(ACL_CACHE_SIZE, ACL_CACHE_TTL_SECONDS)
+
+db_pool.register("assigned_patients", """
+    SELECT cp.patient_id
+    FROM caregiver_patients cp
+    JOIN users u ON u.id = cp.caregiver_id AND u.role = 'caregiver'
+    WHERE cp.caregiver_id = $1
+""")
+
+async def get_assigned_patient_ids(caregiver_id: int) -> frozenset:
+    """Patient ids assigned to a caregiver, served from the ACL cache when possible"""
+    assigned = acl_cache.get(caregiver_id)
+    if assigned is None:
+        rows = await db_pool.fetch("assigned_patients", caregiver_id)
+        assigned = frozenset(row["patient_id"] for row in rows)
+        acl_cache.put(caregiver_id, assigned)
+    return assigned
+
 # Authorization Helper Functions
-async def check_caregiver_patient_access(caregiver_id: int, patient_id: int):
+async def check_caregiver_patient_access(caregiver_id: int, patient_id: int, session: Optional[Session] = None):
     """Check if caregiver has access to this patient"""
-    query = """
-        SELECT assigned_patients FROM users 
-        WHERE id = :caregiver_id AND role = 'caregiver'
-    """
-    caregiver = await database.fetch_one(query, {"caregiver_id": caregiver_id})
-    
-    if not caregiver or not caregiver["assigned_patients"]:
-        return False
-    
-    try:
-        assigned_ids = [int(i.strip()) for i in caregiver["assigned_patients"].split(",")]
-        return patient_id in assigned_ids
-    except:
-        return False
+    if session is not None and session.user_id == caregiver_id:
+        return patient_id in session.patient_ids
+    return patient_id in await get_assigned_patient_ids(caregiver_id)
 
 async def check_note_ownership(caregiver_id: int, note_id: int):
     """Check if note belongs to this caregiver"""
@@ -342,21 +1030,76 @@ async def check_note_ownership(caregiver_id: int, note_id: int):
     note = await database.fetch_one(query, {"note_id": note_id})
     return note and note["caregiver_id"] == caregiver_id
 
-async def check_doctor_role(user_id: int):
+async def check_doctor_role(user_id: int, session: Optional[Session] = None):
     """Check if user is a doctor"""
+    if session is not None and session.user_id == user_id:
+        return session.role == "doctor"
     query = "SELECT role FROM users WHERE id = :user_id"
     user = await database.fetch_one(query, {"user_id": user_id})
     return user and user["role"] == "doctor"
 
+# Caregiver-Patient Assignment Endpoints
+class CaregiverAssignment(BaseModel):
+    caregiver_id: int
+    patient_id: int
+
+async def sync_assignment_change(caregiver_id: int):
+    """Mirror assignments into the legacy users.assigned_patients column and invalidate ACL caches"""
+    await database.execute("""
+        UPDATE users SET assigned_patients = (
+            SELECT string_agg(patient_id::text, ',' ORDER BY patient_id)
+            FROM caregiver_patients WHERE caregiver_id = :caregiver_id
+        )
+        WHERE id = :caregiver_id
+    """, {"caregiver_id": caregiver_id})
+    acl_cache.pop(caregiver_id)
+    await announce(ACL_CHANNEL, [{"caregiver_id": caregiver_id}])
+
+@app.post("/caregiver_patients")
+async def assign_patient(assignment: CaregiverAssignment, user_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
+    """Doktor bir hastayı caregiver'a atar"""
+    require_identity(session, user_id, role)
+    if not await check_doctor_role(user_id, session):
+        raise HTTPException(status_code=403, detail="Only doctors can assign patients")
+
+    try:
+        await database.execute("""
+            INSERT INTO caregiver_patients (caregiver_id, patient_id)
+            VALUES (:caregiver_id, :patient_id)
+            ON CONFLICT DO NOTHING
+        """, {"caregiver_id": assignment.caregiver_id, "patient_id": assignment.patient_id})
+        await sync_assignment_change(assignment.caregiver_id)
+        return {"success": True, "message": "Patient assigned"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/caregiver_patients")
+async def unassign_patient(caregiver_id: int, patient_id: int, user_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
+    """Doktor caregiver'dan hasta atamasını kaldırır"""
+    require_identity(session, user_id, role)
+    if not await check_doctor_role(user_id, session):
+        raise HTTPException(status_code=403, detail="Only doctors can unassign patients")
+
+    try:
+        await database.execute("""
+            DELETE FROM caregiver_patients
+            WHERE caregiver_id = :caregiver_id AND patient_id = :patient_id
+        """, {"caregiver_id": caregiver_id, "patient_id": patient_id})
+        await sync_assignment_change(caregiver_id)
+        return {"success": True, "message": "Patient unassigned"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Caregiver Notes CRUD Endpoints
 @app.post("/caregiver_notes")
-async def create_caregiver_note(note: CaregiverNoteCreate, caregiver_id: int, role: str):
+async def create_caregiver_note(note: CaregiverNoteCreate, caregiver_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
+    require_identity(session, caregiver_id, role)
     # Check if user is caregiver
     if role != "caregiver":
         raise HTTPException(status_code=403, detail="Only caregivers can create notes")
     
     # Check if caregiver has access to this patient
-    if not await check_caregiver_patient_access(caregiver_id, note.patient_id):
+    if not await check_caregiver_patient_access(caregiver_id, note.patient_id, session):
         raise HTTPException(status_code=403, detail="Access denied to this patient")
     
     query = """
@@ -380,43 +1123,216 @@ async def create_caregiver_note(note: CaregiverNoteCreate, caregiver_id: int, ro
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/caregiver_notes")
-async def get_caregiver_notes(caregiver_id: int, role: str, patient_id: Optional[int] = None):
-    # Check if user is caregiver
-    if role != "caregiver":
-        raise HTTPException(status_code=403, detail="Only caregivers can access their notes")
-    
-    base_query = """
+# Not listeleri (created_at, id) üzerinde keyset ile sayfalanır; kullanıcılar sadece sayfa satırları için join edilir
+NOTES_PAGE_SIZE = int(os.getenv("NOTES_PAGE_SIZE", "50"))
+NOTES_MAX_PAGE_SIZE = int(os.getenv("NOTES_MAX_PAGE_SIZE", "200"))
+
+def encode_cursor(*parts) -> str:
+    raw = json.dumps(parts).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        parts = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(parts, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return parts
+
+def encode_note_cursor(created_at: datetime, note_id: int) -> str:
+    return encode_cursor(created_at.isoformat(), note_id)
+
+def decode_note_cursor(cursor: str) -> tuple:
+    try:
+        created_at, note_id = decode_cursor(cursor)
+        return datetime.fromisoformat(created_at), int(note_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def fetch_notes_page(response: Response, where: list, values: dict, limit: Optional[int], cursor: Optional[str],
+                           stream: bool = False):
+    """One newest-first page of notes; X-Next-Cursor is set when more rows may follow"""
+    limit = max(1, min(limit or NOTES_PAGE_SIZE, NOTES_MAX_PAGE_SIZE))
+    if cursor:
+        values = {**values}
+        values["cursor_time"], values["cursor_id"] = decode_note_cursor(cursor)
+        where = where + ["(created_at, id) < (:cursor_time, :cursor_id)"]
+    if stream:
+        # Başlık gövdeden önce gider: sayfanın son satırı indeksten ayrıca okunur. Sayfa LIMIT
+        # yerine bu satıra kadar okunur; arada eklenen notlar sayfayı uzatır ama imleç satır atlamaz
+        try:
+            boundary = await database.fetch_one(f"""
+                SELECT created_at, id FROM caregiver_notes
+                {"WHERE " + " AND ".join(where) if where else ""}
+                ORDER BY created_at DESC, id DESC
+                OFFSET :offset LIMIT 1
+            """, {**values, "offset": limit - 1})
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        headers = None
+        if boundary:
+            headers = {"X-Next-Cursor": encode_note_cursor(boundary["created_at"], boundary["id"])}
+            values = {**values, "boundary_time": boundary["created_at"], "boundary_id": boundary["id"]}
+            where = where + ["(created_at, id) >= (:boundary_time, :boundary_id)"]
+        page_limit = ""
+    else:
+        values = {**values, "limit": limit}
+        page_limit = "LIMIT :limit"
+    query = f"""
         SELECT 
             cn.id, cn.patient_id, cn.caregiver_id, cn.title, cn.content, 
             cn.care_level, cn.created_at, cn.updated_at,
             CONCAT(cu.first_name, ' ', cu.last_name) as caregiver_name,
             CONCAT(pu.first_name, ' ', pu.last_name) as patient_name
-        FROM caregiver_notes cn
+        FROM (
+            SELECT * FROM caregiver_notes
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY created_at DESC, id DESC
+            {page_limit}
+        ) cn
         JOIN users cu ON cn.caregiver_id = cu.id
         JOIN users pu ON cn.patient_id = pu.id
-        WHERE cn.caregiver_id = :caregiver_id
+        ORDER BY cn.created_at DESC, cn.id DESC
     """
+    if stream:
+        try:
+            return await fast_json.stream_rows(database, query, values, headers=headers)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    try:
+        result = await database.fetch_all(query, values)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if len(result) == limit:
+        response.headers["X-Next-Cursor"] = encode_note_cursor(result[-1]["created_at"], result[-1]["id"])
+    return result
+
+@app.get("/caregiver_notes")
+async def get_caregiver_notes(
+    response: Response,
+    caregiver_id: int,
+    role: str,
+    patient_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    session: Optional[Session] = Depends(optional_session)
+):
+    require_identity(session, caregiver_id, role)
+    # Check if user is caregiver
+    if role != "caregiver":
+        raise HTTPException(status_code=403, detail="Only caregivers can access their notes")
     
+    where = ["caregiver_id = :caregiver_id"]
     values = {"caregiver_id": caregiver_id}
     
     if patient_id:
         # Check access to specific patient
-        if not await check_caregiver_patient_access(caregiver_id, patient_id):
+        if not await check_caregiver_patient_access(caregiver_id, patient_id, session):
             raise HTTPException(status_code=403, detail="Access denied to this patient")
-        base_query += " AND cn.patient_id = :patient_id"
+        where.append("patient_id = :patient_id")
         values["patient_id"] = patient_id
     
-    base_query += " ORDER BY cn.created_at DESC"
-    
+    return await fetch_notes_page(response, where, values, limit, cursor, stream)
+
+# Tam metin arama: search_vector kolonları ve GIN indeksleri schema.sql'de tutulur
+SEARCH_CONFIG = "simple"
+
+@app.get("/caregiver_notes/search")
+async def search_caregiver_notes(
+    response: Response,
+    q: str,
+    user_id: int,
+    role: str,
+    patient_id: Optional[int] = None,
+    care_level: Optional[int] = None,
+    include_chat: bool = False,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    session: Optional[Session] = Depends(optional_session)
+):
+    """Ranked full-text search over note titles/contents and, optionally, their chat messages"""
+    require_identity(session, user_id, role)
+    if not await check_doctor_role(user_id, session):
+        raise HTTPException(status_code=403, detail="Only doctors can search notes")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query is empty")
+
+    limit = max(1, min(limit or NOTES_PAGE_SIZE, NOTES_MAX_PAGE_SIZE))
+    values = {"q": q, "limit": limit}
+    filters = ""
+    if patient_id is not None:
+        filters += " AND cn.patient_id = :patient_id"
+        values["patient_id"] = patient_id
+    if care_level is not None:
+        if care_level < 1 or care_level > 5:
+            raise HTTPException(status_code=400, detail="Care level must be between 1 and 5")
+        filters += " AND cn.care_level = :care_level"
+        values["care_level"] = care_level
+
+    chat_hits = ""
+    if include_chat:
+        chat_hits = f"""
+            UNION ALL
+            SELECT cm.note_id, ts_rank_cd(cm.search_vector, q.query)
+            FROM chat_messages cm
+            JOIN caregiver_notes cn ON cn.id = cm.note_id, q
+            WHERE cm.search_vector @@ q.query{filters}
+        """
+    page_filter = ""
+    if cursor:
+        try:
+            cursor_rank, cursor_id = decode_cursor(cursor)
+            values["cursor_rank"], values["cursor_id"] = float(cursor_rank), int(cursor_id)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        page_filter = "WHERE (rank, note_id) < (CAST(:cursor_rank AS real), :cursor_id)"
+
+    # Eşleşmeler GIN indeksinden gelir; sıralama ve özet sadece sayfadaki notlar için hesaplanır
+    query = f"""
+        WITH q AS (
+            SELECT websearch_to_tsquery('{SEARCH_CONFIG}', :q) AS query
+        ), hits (note_id, rank) AS (
+            SELECT cn.id, ts_rank_cd(cn.search_vector, q.query)
+            FROM caregiver_notes cn, q
+            WHERE cn.search_vector @@ q.query{filters}
+            {chat_hits}
+        ), matched AS (
+            SELECT note_id, MAX(rank) AS rank
+            FROM hits
+            GROUP BY note_id
+        )
+        SELECT
+            cn.id, cn.patient_id, cn.caregiver_id, cn.title, cn.content,
+            cn.care_level, cn.created_at, cn.updated_at,
+            CONCAT(cu.first_name, ' ', cu.last_name) as caregiver_name,
+            CONCAT(pu.first_name, ' ', pu.last_name) as patient_name,
+            p.rank,
+            ts_headline('{SEARCH_CONFIG}', cn.content, q.query) AS snippet
+        FROM (
+            SELECT * FROM matched
+            {page_filter}
+            ORDER BY rank DESC, note_id DESC
+            LIMIT :limit
+        ) p
+        JOIN caregiver_notes cn ON cn.id = p.note_id
+        JOIN users cu ON cn.caregiver_id = cu.id
+        JOIN users pu ON cn.patient_id = pu.id
+        CROSS JOIN q
+        ORDER BY p.rank DESC, p.note_id DESC
+    """
     try:
-        result = await database.fetch_all(base_query, values)
-        return result
+        result = await database.fetch_all(query, values)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if len(result) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(result[-1]["rank"], result[-1]["id"])
+    return result
 
 @app.put("/caregiver_notes/{note_id}")
-async def update_caregiver_note(note_id: int, note_update: CaregiverNoteUpdate, caregiver_id: int, role: str):
+async def update_caregiver_note(note_id: int, note_update: CaregiverNoteUpdate, caregiver_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
+    require_identity(session, caregiver_id, role)
     # Check if user is caregiver
     if role != "caregiver":
         raise HTTPException(status_code=403, detail="Only caregivers can update notes")
@@ -452,7 +1368,8 @@ async def update_caregiver_note(note_id: int, note_update: CaregiverNoteUpdate,
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/caregiver_notes/{note_id}")
-async def delete_caregiver_note(note_id: int, caregiver_id: int, role: str):
+async def delete_caregiver_note(note_id: int, caregiver_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
+    require_identity(session, caregiver_id, role)
     # Check if user is caregiver
     if role != "caregiver":
         raise HTTPException(status_code=403, detail="Only caregivers can delete notes")
@@ -461,7 +1378,30 @@ async def delete_caregiver_note(note_id: int, caregiver_id: int, role: str):
     if not await check_note_ownership(caregiver_id, note_id):
         raise HTTPException(status_code=403, detail="You can only delete your own notes")
     
-    query = "DELETE FROM caregiver_notes WHERE id = :note_id"
+    # Not silinince mesajları ve watermark'lar cascade ile gider; okunmamış mesajlar aynı ifadede
+    # ilgili kullanıcıların sayaçlarından düşülür (alıcı kuralı send_chat_message ile aynı)
+    query = """
+        WITH forgotten AS (
+            SELECT u.id AS user_id, COUNT(cm.id) AS n
+            FROM caregiver_notes n
+            JOIN chat_messages cm ON cm.note_id = n.id
+            JOIN users u
+              ON cm.sender_id <> u.id
+             AND (
+                 (u.role = 'caregiver' AND u.id = n.caregiver_id)
+              OR (u.role = 'doctor' AND cm.sender_role = 'caregiver')
+             )
+            LEFT JOIN chat_read_state rs ON rs.note_id = n.id AND rs.user_id = u.id
+            WHERE n.id = :note_id AND cm.id > COALESCE(rs.last_read_message_id, 0)
+            GROUP BY u.id
+        ), counted AS (
+            UPDATE unread_counters uc
+            SET count = GREATEST(uc.count - f.n, 0)
+            FROM forgotten f
+            WHERE uc.user_id = f.user_id AND uc.kind = 'chat'
+        )
+        DELETE FROM caregiver_notes WHERE id = :note_id
+    """
     
     try:
         await database.execute(query, {"note_id": note_id})
@@ -471,208 +1411,284 @@ async def delete_caregiver_note(note_id: int, caregiver_id: int, role: str):
 
 # Doctor Read-Only Endpoints
 @app.get("/caregiver_notes/by_patient/{patient_id}")
-async def get_notes_by_patient(patient_id: int, user_id: int, role: str):
+async def get_notes_by_patient(
+    response: Response,
+    patient_id: int,
+    user_id: int,
+    role: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    session: Optional[Session] = Depends(optional_session)
+):
+    require_identity(session, user_id, role)
     # Check if user is doctor
-    if not await check_doctor_role(user_id):
+    if not await check_doctor_role(user_id, session):
         raise HTTPException(status_code=403, detail="Only doctors can view patient notes")
     
-    query = """
-        SELECT 
-            cn.id, cn.patient_id, cn.caregiver_id, cn.title, cn.content, 
-            cn.care_level, cn.created_at, cn.updated_at,
-            CONCAT(cu.first_name, ' ', cu.last_name) as caregiver_name,
-            CONCAT(pu.first_name, ' ', pu.last_name) as patient_name
-        FROM caregiver_notes cn
-        JOIN users cu ON cn.caregiver_id = cu.id
-        JOIN users pu ON cn.patient_id = pu.id
-        WHERE cn.patient_id = :patient_id
-        ORDER BY cn.created_at DESC
-    """
-    
-    try:
-        result = await database.fetch_all(query, {"patient_id": patient_id})
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await fetch_notes_page(response, ["patient_id = :patient_id"], {"patient_id": patient_id}, limit, cursor, stream)
 
 @app.get("/caregiver_notes/by_care_level")
 async def get_notes_by_care_level(
+    response: Response,
     user_id: int, 
     role: str, 
     care_level: Optional[int] = None,
     patient_id: Optional[int] = None,
-    limit: int = 50
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    session: Optional[Session] = Depends(optional_session)
 ):
+    require_identity(session, user_id, role)
     # Check if user is doctor
-    if not await check_doctor_role(user_id):
+    if not await check_doctor_role(user_id, session):
         raise HTTPException(status_code=403, detail="Only doctors can filter notes")
     
-    base_query = """
-        SELECT 
-            cn.id, cn.patient_id, cn.caregiver_id, cn.title, cn.content, 
-            cn.care_level, cn.created_at, cn.updated_at,
-            CONCAT(cu.first_name, ' ', cu.last_name) as caregiver_name,
-            CONCAT(pu.first_name, ' ', pu.last_name) as patient_name
-        FROM caregiver_notes cn
-        JOIN users cu ON cn.caregiver_id = cu.id
-        JOIN users pu ON cn.patient_id = pu.id
-        WHERE 1=1
-    """
-    
-    values = {"limit": limit}
+    where = []
+    values = {}
     
     if care_level is not None:
         if care_level < 1 or care_level > 5:
             raise HTTPException(status_code=400, detail="Care level must be between 1 and 5")
-        base_query += " AND cn.care_level = :care_level"
+        where.append("care_level = :care_level")
         values["care_level"] = care_level
     
     if patient_id is not None:
-        base_query += " AND cn.patient_id = :patient_id"
+        where.append("patient_id = :patient_id")
         values["patient_id"] = patient_id
     
-    base_query += " ORDER BY cn.created_at DESC LIMIT :limit"
-    
-    try:
-        result = await database.fetch_all(base_query, values)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await fetch_notes_page(response, where, values, limit, cursor, stream)
 
 @app.get("/caregiver_notes/all")
-async def get_all_notes(user_id: int, role: str, limit: int = 100):
+async def get_all_notes(
+    response: Response,
+    user_id: int,
+    role: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    session: Optional[Session] = Depends(optional_session)
+):
+    require_identity(session, user_id, role)
     # Check if user is doctor
-    if not await check_doctor_role(user_id):
+    if not await check_doctor_role(user_id, session):
         raise HTTPException(status_code=403, detail="Only doctors can view all notes")
     
-    query = """
-        SELECT 
-            cn.id, cn.patient_id, cn.caregiver_id, cn.title, cn.content, 
-            cn.care_level, cn.created_at, cn.updated_at,
-            CONCAT(cu.first_name, ' ', cu.last_name) as caregiver_name,
-            CONCAT(pu.first_name, ' ', pu.last_name) as patient_name
-        FROM caregiver_notes cn
-        JOIN users cu ON cn.caregiver_id = cu.id
-        JOIN users pu ON cn.patient_id = pu.id
-        ORDER BY cn.created_at DESC
+    return await fetch_notes_page(response, [], {}, limit, cursor, stream)
+
+# Hasta başına gruplama SQL'de yapılır (json_agg + LATERAL limit); yanıt satır satır akıtılır
+DOCTOR_NOTES_PER_PATIENT = int(os.getenv("DOCTOR_NOTES_PER_PATIENT", "20"))
+DOCTOR_MAX_NOTES_PER_PATIENT = 100
+DOCTOR_PATIENTS_PAGE_SIZE = 100
+DOCTOR_PATIENTS_MAX_PAGE_SIZE = 500
+
+DOCTOR_PATIENT_NOTES_SQL = """
+    SELECT p.id AS patient_id, p.patient_name, p.email AS patient_email, n.note_count, n.notes
+    FROM (
+        SELECT u.id, CONCAT(u.first_name, ' ', u.last_name) AS patient_name, u.email, latest.created_at
+        FROM (SELECT DISTINCT patient_id FROM caregiver_patients) panel
+        JOIN users u ON u.id = panel.patient_id
+        CROSS JOIN LATERAL (
+            SELECT created_at FROM caregiver_notes
+            WHERE patient_id = u.id
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        ) latest
+        WHERE u.role = 'patient'
+        ORDER BY latest.created_at DESC, u.id
         LIMIT :limit
-    """
-    
-    try:
-        result = await database.fetch_all(query, {"limit": limit})
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    ) p
+    CROSS JOIN LATERAL (
+        SELECT
+            COUNT(*) AS note_count,
+            json_agg(json_build_object(
+                'note_id', cn.id,
+                'title', cn.title,
+                'content', cn.content,
+                'care_level', cn.care_level,
+                'caregiver_name', CONCAT(cu.first_name, ' ', cu.last_name),
+                'caregiver_id', cn.caregiver_id,
+                'created_at', cn.created_at,
+                'updated_at', cn.updated_at
+            ) ORDER BY cn.created_at DESC, cn.id DESC) AS notes
+        FROM (
+            SELECT * FROM caregiver_notes
+            WHERE patient_id = p.id
+            ORDER BY created_at DESC, id DESC
+            LIMIT :notes_per_patient
+        ) cn
+        JOIN users cu ON cn.caregiver_id = cu.id
+    ) n
+    ORDER BY p.created_at DESC, p.id
+"""
 
 @app.get("/doctor/my_patients_notes")
-async def get_doctor_patients_notes(user_id: int, role: str, limit: int = 100):
-    """Doktorun sahip olduğu hastaların tüm caregiver notlarını listele"""
+async def get_doctor_patients_notes(
+    user_id: int,
+    role: str,
+    limit: int = DOCTOR_PATIENTS_PAGE_SIZE,
+    notes_per_patient: int = DOCTOR_NOTES_PER_PATIENT,
+    session: Optional[Session] = Depends(optional_session)
+):
+    """List caregiver notes grouped per patient for the doctor's assigned patients, streamed"""
+    require_identity(session, user_id, role)
     # Check if user is doctor
-    if not await check_doctor_role(user_id):
+    if not await check_doctor_role(user_id, session):
         raise HTTPException(status_code=403, detail="Only doctors can view patient notes")
     
-    query = """
-        SELECT 
-            cn.id, cn.patient_id, cn.caregiver_id, cn.title, cn.content, 
-            cn.care_level, cn.created_at, cn.updated_at,
-            CONCAT(cu.first_name, ' ', cu.last_name) as caregiver_name,
-            CONCAT(pu.first_name, ' ', pu.last_name) as patient_name,
-            pu.email as patient_email
-        FROM caregiver_notes cn
-        JOIN users cu ON cn.caregiver_id = cu.id
-        JOIN users pu ON cn.patient_id = pu.id
-        WHERE pu.role = 'patient'
-        ORDER BY cn.created_at DESC, pu.first_name ASC
-        LIMIT :limit
-    """
-    
+    values = {
+        "limit": max(1, min(limit, DOCTOR_PATIENTS_MAX_PAGE_SIZE)),
+        "notes_per_patient": max(1, min(notes_per_patient, DOCTOR_MAX_NOTES_PER_PATIENT))
+    }
+
+    # İlk satır yanıt başlamadan okunur; sorgu hataları hâlâ 500 olarak dönebilir
     try:
-        result = await database.fetch_all(query, {"limit": limit})
-        
-        # Grupla hastalara göre organize et
-        patients_notes = {}
-        for note in result:
-            patient_key = f"{note['patient_name']} (ID: {note['patient_id']})"
-            if patient_key not in patients_notes:
-                patients_notes[patient_key] = {
-                    "patient_info": {
-                        "patient_id": note["patient_id"],
-                        "patient_name": note["patient_name"],
-                        "patient_email": note["patient_email"]
-                    },
-                    "notes": []
-                }
-            
-            patients_notes[patient_key]["notes"].append({
-                "note_id": note["id"],
-                "title": note["title"],
-                "content": note["content"],
-                "care_level": note["care_level"],
-                "caregiver_name": note["caregiver_name"],
-                "caregiver_id": note["caregiver_id"],
-                "created_at": note["created_at"],
-                "updated_at": note["updated_at"]
-            })
-        
-        return {
-            "total_patients": len(patients_notes),
-            "total_notes": len(result),
-            "patients_with_notes": patients_notes
-        }
+        rows = await fast_json.prefetch(database.iterate(DOCTOR_PATIENT_NOTES_SQL, values))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def body():
+        total_patients = 0
+        total_notes = 0
+        yield '{"patients_with_notes": {'
+        try:
+            async for row in rows:
+                patient_key = f"{row['patient_name']} (ID: {row['patient_id']})"
+                patient_info = {
+                    "patient_id": row["patient_id"],
+                    "patient_name": row["patient_name"],
+                    "patient_email": row["patient_email"]
+                }
+                # notes Postgres'te JSON'a çevrildi; Python'da tekrar ayrıştırılmaz
+                yield (
+                    ("," if total_patients else "")
+                    + f'{json.dumps(patient_key)}: {{"patient_info": {json.dumps(patient_info)}, "notes": {row["notes"]}}}'
+                )
+                total_patients += 1
+                total_notes += row["note_count"]
+        except Exception as e:
+            # Başlıklar gönderildi; hata loglanır ve yanıt yarıda kesilir, eksik gövde tamam gibi kapanmaz
+            print("/doctor/my_patients_notes error:", e)
+            raise
+        yield f'}}, "total_patients": {total_patients}, "total_notes": {total_notes}}}'
+
+    return StreamingResponse(body(), media_type="application/json")
+
 
 # Critical Alert Models
 class CriticalAlertInput(BaseModel):
     patient_id: int
     heart_rate: int
-    threshold_value: int
+    threshold_value: float
     message: str
+    alert_type: str = "critical_heart_rate"
+
+# Aynı hasta ve tipte, okunmamış bir alert bu süre içinde tekrar gelirse yeni satır yazılmaz
+ALERT_COALESCE_WINDOW_SECONDS = int(os.getenv("ALERT_COALESCE_WINDOW_SECONDS", "300"))
+
+FAN_OUT_ALERT_SQL = """
+    WITH recipients AS (
+        SELECT caregiver_id FROM caregiver_patients WHERE patient_id = :patient_id
+    ), coalesced AS (
+        UPDATE critical_alerts ca
+        SET occurrence_count = ca.occurrence_count + 1,
+            last_seen_at = NOW(),
+            heart_rate = :heart_rate,
+            threshold_value = :threshold_value,
+            message = :message
+        FROM recipients r
+        WHERE ca.caregiver_id = r.caregiver_id
+          AND ca.patient_id = :patient_id
+          AND ca.alert_type = :alert_type
+          AND ca.is_read = false
+          AND ca.last_seen_at > NOW() - make_interval(secs => :window)
+        RETURNING ca.caregiver_id
+    ), inserted AS (
+        INSERT INTO critical_alerts
+        (patient_id, caregiver_id, alert_type, heart_rate, threshold_value, message, is_read, created_at, last_seen_at)
+        SELECT :patient_id, r.caregiver_id, :alert_type, :heart_rate, :threshold_value, :message, false, NOW(), NOW()
+        FROM recipients r
+        WHERE r.caregiver_id NOT IN (SELECT caregiver_id FROM coalesced)
+        RETURNING caregiver_id
+    ), counted AS (
+        -- Birleştirilen alert'ler zaten okunmamış; sadece yeni satırlar sayacı artırır
+        INSERT INTO unread_counters (user_id, kind, count)
+        SELECT caregiver_id, 'alert', COUNT(*) FROM inserted GROUP BY caregiver_id
+        ON CONFLICT (user_id, kind) DO UPDATE SET count = unread_counters.count + EXCLUDED.count
+    )
+    SELECT 'inserted' AS outcome, caregiver_id FROM inserted
+    UNION ALL
+    SELECT DISTINCT 'coalesced' AS outcome, caregiver_id FROM coalesced
+"""
+
+async def fan_out_critical_alert(patient_id: int, alert_type: str, heart_rate: int,
+                                 threshold_value: float, message: str) -> dict:
+    """Insert or coalesce an alert for every assigned caregiver in one statement"""
+    async with database.transaction():
+        # Aynı hasta için eşzamanlı iki fan-out ikisi de "okunmamış yok" görüp çift satır yazmasın;
+        # kilit ifadeden önce alınır ki ifade öncekinin commit ettiği satırları görsün
+        await database.execute("SELECT pg_advisory_xact_lock(hashtext('critical_alert'), :patient_id)",
+                               {"patient_id": patient_id})
+        rows = await database.fetch_all(FAN_OUT_ALERT_SQL, {
+            "patient_id": patient_id,
+            "alert_type": alert_type,
+            "heart_rate": heart_rate,
+            "threshold_value": threshold_value,
+            "message": message,
+            "window": ALERT_COALESCE_WINDOW_SECONDS
+        })
+    inserted = [row["caregiver_id"] for row in rows if row["outcome"] == "inserted"]
+    coalesced = [row["caregiver_id"] for row in rows if row["outcome"] == "coalesced"]
+
+    if rows:
+        await announce(ALERT_CHANNEL, [{
+            "patient_id": patient_id,
+            "caregiver_ids": inserted + coalesced,
+            "alert_type": alert_type,
+            "heart_rate": heart_rate,
+            "threshold_value": threshold_value,
+            "message": message
+        }])
+    return {"inserted": inserted, "coalesced": coalesced}
 
 @app.post("/critical_alert")
 async def send_critical_alert(alert_data: CriticalAlertInput):
     """Critical heart rate alert'ini hasta bakıcılara gönder"""
     try:
-        # Hastaya atanmış caregiver'ları bul
-        caregiver_query = """
-            SELECT id FROM users 
-            WHERE role = 'caregiver' 
-            AND (assigned_patients IS NULL OR assigned_patients LIKE :patient_search)
-        """
-        patient_search = f"%{alert_data.patient_id}%"
-        caregivers = await database.fetch_all(caregiver_query, {"patient_search": patient_search})
-        
-        if not caregivers:
-            raise HTTPException(status_code=404, detail="No caregivers found for this patient")
-        
-        # Her caregiver'a alert gönder
-        for caregiver in caregivers:
-            alert_query = """
-                INSERT INTO critical_alerts 
-                (patient_id, caregiver_id, alert_type, heart_rate, threshold_value, message, is_read, created_at)
-                VALUES (:patient_id, :caregiver_id, 'critical_heart_rate', :heart_rate, :threshold_value, :message, false, NOW())
-            """
-            await database.execute(alert_query, {
-                "patient_id": alert_data.patient_id,
-                "caregiver_id": caregiver["id"],
-                "heart_rate": alert_data.heart_rate,
-                "threshold_value": alert_data.threshold_value,
-                "message": alert_data.message
-            })
-        
-        return {
-            "success": True,
-            "message": f"Critical alert sent to {len(caregivers)} caregiver(s)",
-            "caregivers_notified": len(caregivers)
-        }
+        result = await fan_out_critical_alert(
+            alert_data.patient_id,
+            alert_data.alert_type,
+            alert_data.heart_rate,
+            alert_data.threshold_value,
+            alert_data.message
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    recipients = len(result["inserted"]) + len(result["coalesced"])
+    if not recipients:
+        raise HTTPException(status_code=404, detail="No caregivers found for this patient")
+
+    return {
+        "success": True,
+        "message": f"Critical alert sent to {recipients} caregiver(s)",
+        "caregivers_notified": recipients,
+        "new_alerts": len(result["inserted"]),
+        "coalesced_alerts": len(result["coalesced"])
+    }
+
 
 @app.get("/critical_alerts")
-async def get_critical_alerts(caregiver_id: int, role: str, unread_only: bool = False):
+async def get_critical_alerts(
+    caregiver_id: int,
+    role: str,
+    unread_only: bool = False,
+    stream: bool = False,
+    session: Optional[Session] = Depends(optional_session)
+):
     """Caregiver'ın critical alert'lerini getir"""
+    require_identity(session, caregiver_id, role)
     if role != 'caregiver':
         raise HTTPException(status_code=403, detail="Only caregivers can view alerts")
     
@@ -684,7 +1700,7 @@ async def get_critical_alerts(caregiver_id: int, role: str, unread_only: bool =
         query = f"""
             SELECT 
                 ca.id, ca.patient_id, ca.alert_type, ca.heart_rate, ca.threshold_value,
-                ca.message, ca.is_read, ca.created_at,
+                ca.message, ca.is_read, ca.created_at, ca.occurrence_count, ca.last_seen_at,
                 CONCAT(u.first_name, ' ', u.last_name) as patient_name,
                 u.email as patient_email
             FROM critical_alerts ca
@@ -694,6 +1710,12 @@ async def get_critical_alerts(caregiver_id: int, role: str, unread_only: bool =
             LIMIT 50
         """
         
+        if stream:
+            return await fast_json.stream_rows(
+                database, query, {"caregiver_id": caregiver_id},
+                prefix='{"success":true,"alerts":[',
+                suffix=lambda count, last: f'],"total_alerts":{count}}}'
+            )
         alerts = await database.fetch_all(query, {"caregiver_id": caregiver_id})
         
         return {
@@ -705,31 +1727,47 @@ async def get_critical_alerts(caregiver_id: int, role: str, unread_only: bool =
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/critical_alerts/unread_count")
+async def get_unread_alert_count(caregiver_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
+    """Caregiver'ın okunmamış alert sayısı (bakımı yapılan sayaçtan)"""
+    require_identity(session, caregiver_id, role)
+    if role != 'caregiver':
+        raise HTTPException(status_code=403, detail="Only caregivers can view alerts")
+    counts = await get_unread_counts(caregiver_id)
+    return {"success": True, "unread_count": counts["alert"]}
+
+
 @app.put("/critical_alerts/{alert_id}/mark_read")
-async def mark_alert_as_read(alert_id: int, caregiver_id: int, role: str):
+async def mark_alert_as_read(alert_id: int, caregiver_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
     """Critical alert'i okundu olarak işaretle"""
+    require_identity(session, caregiver_id, role)
     if role != 'caregiver':
         raise HTTPException(status_code=403, detail="Only caregivers can mark alerts as read")
     
     try:
-        # Önce alert'in bu caregiver'a ait olduğunu kontrol et
-        check_query = "SELECT id FROM critical_alerts WHERE id = :alert_id AND caregiver_id = :caregiver_id"
-        alert = await database.fetch_one(check_query, {"alert_id": alert_id, "caregiver_id": caregiver_id})
-        
-        if not alert:
-            raise HTTPException(status_code=404, detail="Alert not found or unauthorized")
-        
-        # Alert'i okundu olarak işaretle
+        # Alert'i okundu olarak işaretle; sayaç sadece okunmamıştan okunmuşa geçişte azalır
         update_query = """
-            UPDATE critical_alerts 
-            SET is_read = true 
-            WHERE id = :alert_id AND caregiver_id = :caregiver_id
+            WITH marked AS (
+                UPDATE critical_alerts 
+                SET is_read = true 
+                WHERE id = :alert_id AND caregiver_id = :caregiver_id AND is_read = false
+                RETURNING id
+            ), counted AS (
+                UPDATE unread_counters
+                SET count = GREATEST(count - 1, 0)
+                WHERE user_id = :caregiver_id AND kind = 'alert' AND EXISTS (SELECT 1 FROM marked)
+            )
+            SELECT EXISTS (
+                SELECT 1 FROM critical_alerts WHERE id = :alert_id AND caregiver_id = :caregiver_id
+            ) AS found
         """
-        await database.execute(update_query, {"alert_id": alert_id, "caregiver_id": caregiver_id})
-        
-        return {"success": True, "message": "Alert marked as read"}
+        found = await database.fetch_val(update_query, {"alert_id": alert_id, "caregiver_id": caregiver_id})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    if not found:
+        raise HTTPException(status_code=404, detail="Alert not found or unauthorized")
+    return {"success": True, "message": "Alert marked as read"}
 
 
 # Doctor Feedback Models
@@ -753,8 +1791,9 @@ class ChatResponse(BaseModel):
     is_read: bool
 
 @app.post("/doctor_feedback")
-async def add_doctor_feedback(feedback_data: DoctorFeedbackInput, user_id: int, role: str):
+async def add_doctor_feedback(feedback_data: DoctorFeedbackInput, user_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
     """Doktor caregiver notuna dönüt ekler"""
+    require_identity(session, user_id, role)
     if role != 'doctor':
         raise HTTPException(status_code=403, detail="Only doctors can add feedback")
     
@@ -794,8 +1833,9 @@ async def add_doctor_feedback(feedback_data: DoctorFeedbackInput, user_id: int,
 
 
 @app.get("/doctor_feedback/{note_id}")
-async def get_feedback_for_note(note_id: int, user_id: int, role: str):
+async def get_feedback_for_note(note_id: int, user_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
     """Belirli bir note için doktor dönütlerini getir"""
+    require_identity(session, user_id, role)
     if role not in ['doctor', 'caregiver']:
         raise HTTPException(status_code=403, detail="Only doctors and caregivers can view feedback")
     
@@ -821,8 +1861,10 @@ async def get_feedback_for_note(note_id: int, user_id: int, role: str):
 
 
 @app.get("/caregiver_feedback")
-async def get_caregiver_feedback(caregiver_id: int, role: str, limit: int = 50):
+async def get_caregiver_feedback(caregiver_id: int, role: str, limit: int = 50, stream: bool = False,
+                                 session: Optional[Session] = Depends(optional_session)):
     """Bakıcının aldığı tüm doktor dönütlerini ve kendi notlarını getir"""
+    require_identity(session, caregiver_id, role)
     if role != 'caregiver':
         raise HTTPException(status_code=403, detail="Only caregivers can view their feedback")
     
@@ -876,6 +1918,12 @@ async def get_caregiver_feedback(caregiver_id: int, role: str, limit: int = 50):
             LIMIT :limit
         """
         
+        if stream:
+            return await fast_json.stream_rows(
+                database, combined_query, {"caregiver_id": caregiver_id, "limit": limit},
+                prefix='{"success":true,"feedback":[',
+                suffix=lambda count, last: f'],"total":{count}}}'
+            )
         feedback_list = await database.fetch_all(combined_query, {
             "caregiver_id": caregiver_id,
             "limit": limit
@@ -892,8 +1940,9 @@ async def get_caregiver_feedback(caregiver_id: int, role: str, limit: int = 50):
 
 # Chat Endpoints
 @app.post("/chat/send")
-async def send_chat_message(message: ChatMessage, user_id: int, role: str):
+async def send_chat_message(message: ChatMessage, user_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
     """Note için chat mesajı gönder"""
+    require_identity(session, user_id, role)
     if role not in ['doctor', 'caregiver']:
         raise HTTPException(status_code=403, detail="Only doctors and caregivers can send messages")
     
@@ -912,11 +1961,27 @@ async def send_chat_message(message: ChatMessage, user_id: int, role: str):
         if role == 'caregiver' and note["caregiver_id"] != user_id:
             raise HTTPException(status_code=403, detail="You can only chat on your own notes")
         
-        # Mesajı kaydet
+        # Mesajı kaydet ve alıcıların okunmamış sayaçlarını aynı ifadede artır:
+        # caregiver mesajları tüm doktorlara, doktor mesajları notun caregiver'ına gider
         insert_query = """
-            INSERT INTO chat_messages (note_id, sender_id, sender_role, content, created_at)
-            VALUES (:note_id, :sender_id, :sender_role, :content, NOW())
-            RETURNING id, created_at
+            WITH msg AS (
+                INSERT INTO chat_messages (note_id, sender_id, sender_role, content, created_at)
+                VALUES (:note_id, :sender_id, :sender_role, :content, NOW())
+                RETURNING id, created_at
+            ), recipients AS (
+                SELECT id AS user_id FROM users
+                WHERE :sender_role = 'caregiver' AND role = 'doctor' AND id <> :sender_id
+                UNION
+                SELECT caregiver_id FROM caregiver_notes
+                WHERE :sender_role = 'doctor' AND id = :note_id
+            ), counted AS (
+                INSERT INTO unread_counters (user_id, kind, count)
+                SELECT user_id, 'chat', 1 FROM recipients
+                ON CONFLICT (user_id, kind) DO UPDATE SET count = unread_counters.count + 1
+            )
+            SELECT id, created_at,
+                (SELECT CONCAT(first_name, ' ', last_name) FROM users WHERE id = :sender_id) AS sender_name
+            FROM msg
         """
         result = await database.fetch_one(insert_query, {
             "note_id": message.note_id,
@@ -925,6 +1990,17 @@ async def send_chat_message(message: ChatMessage, user_id: int, role: str):
             "content": message.content
         })
         
+        # Notun chat akışını dinleyen istemcilere gönder
+        await announce(CHAT_CHANNEL, [{
+            "id": result["id"],
+            "note_id": message.note_id,
+            "sender_id": user_id,
+            "sender_role": role,
+            "sender_name": result["sender_name"],
+            "content": message.content,
+            "created_at": result["created_at"]
+        }])
+        
         return {
             "success": True,
             "message_id": result["id"],
@@ -934,89 +2010,167 @@ async def send_chat_message(message: ChatMessage, user_id: int, role: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/chat/{note_id}")
-async def get_chat_messages(note_id: int, user_id: int, role: str):
-    """Note için chat mesajlarını getir"""
+# Chat sync: mesajlar id sırasıyla artımlı okunur, okundu bilgisi kullanıcı başına bir watermark'tır
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "500"))
+
+db_pool.register("chat_messages", """
+    SELECT
+        cm.id, cm.note_id, cm.sender_id, cm.sender_role, cm.content,
+        cm.created_at,
+        CONCAT(u.first_name, ' ', u.last_name) as sender_name
+    FROM chat_messages cm
+    JOIN users u ON cm.sender_id = u.id
+    WHERE cm.note_id = $1 AND cm.id > $2
+    ORDER BY cm.id ASC
+    LIMIT $3
+""")
+db_pool.register("chat_messages_before", """
+    SELECT
+        cm.id, cm.note_id, cm.sender_id, cm.sender_role, cm.content,
+        cm.created_at,
+        CONCAT(u.first_name, ' ', u.last_name) as sender_name
+    FROM chat_messages cm
+    JOIN users u ON cm.sender_id = u.id
+    WHERE cm.note_id = $1 AND cm.id < $2
+    ORDER BY cm.id DESC
+    LIMIT $3
+""")
+db_pool.register("chat_read_state", """
+    SELECT user_id, last_read_message_id FROM chat_read_state WHERE note_id = $1
+""")
+db_pool.register("unread_counts", """
+    SELECT kind, count FROM unread_counters WHERE user_id = $1
+""")
+
+async def get_unread_counts(user_id: int) -> dict:
+    counts = {"chat": 0, "alert": 0}
+    for row in await db_pool.fetch("unread_counts", user_id):
+        counts[row["kind"]] = row["count"]
+    return counts
+
+async def advance_chat_watermark(note_id: int, user_id: int, role: str, message_id: int):
+    """Move the user's read watermark forward and take the newly read messages off their unread counter"""
+    async with database.transaction():
+        # Satırı kilitler ve önceki watermark'ı döndürür; eşzamanlı okumalar aynı mesajları iki kez düşmez
+        previous = await database.fetch_val("""
+            INSERT INTO chat_read_state (note_id, user_id, last_read_message_id)
+            VALUES (:note_id, :user_id, 0)
+            ON CONFLICT (note_id, user_id) DO UPDATE SET note_id = EXCLUDED.note_id
+            RETURNING last_read_message_id
+        """, {"note_id": note_id, "user_id": user_id})
+        if message_id <= previous:
+            return
+        await database.execute("""
+            WITH advanced AS (
+                UPDATE chat_read_state
+                SET last_read_message_id = :message_id, updated_at = NOW()
+                WHERE note_id = :note_id AND user_id = :user_id
+            ), newly_read AS (
+                SELECT COUNT(*) AS n
+                FROM chat_messages
+                WHERE note_id = :note_id AND id > :previous AND id <= :message_id
+                  AND sender_id <> :user_id
+                  AND (:role = 'caregiver' OR sender_role = 'caregiver')
+            )
+            UPDATE unread_counters uc
+            SET count = GREATEST(uc.count - newly_read.n, 0)
+            FROM newly_read
+            WHERE uc.user_id = :user_id AND uc.kind = 'chat' AND newly_read.n > 0
+        """, {"note_id": note_id, "user_id": user_id, "role": role, "previous": previous, "message_id": message_id})
+
+async def get_chat_note(note_id: int, user_id: int, role: str):
+    """The note a chat belongs to, after checking that the user may take part in it"""
     if role not in ['doctor', 'caregiver']:
         raise HTTPException(status_code=403, detail="Only doctors and caregivers can view messages")
-    
-    try:
-        # Note'un varlığını ve yetki kontrolünü yap
-        note_query = """
-            SELECT patient_id, caregiver_id FROM caregiver_notes 
-            WHERE id = :note_id
-        """
-        note = await database.fetch_one(note_query, {"note_id": note_id})
-        
-        if not note:
-            raise HTTPException(status_code=404, detail="Note not found")
-        
-        # Yetki kontrolü
-        if role == 'caregiver' and note["caregiver_id"] != user_id:
-            raise HTTPException(status_code=403, detail="You can only view chat on your own notes")
-        
-        # Chat mesajlarını getir
-        messages_query = """
-            SELECT 
-                cm.id, cm.note_id, cm.sender_id, cm.sender_role, cm.content, 
-                cm.created_at, cm.is_read,
-                CONCAT(u.first_name, ' ', u.last_name) as sender_name
-            FROM chat_messages cm
-            JOIN users u ON cm.sender_id = u.id
-            WHERE cm.note_id = :note_id
-            ORDER BY cm.created_at ASC
-        """
-        
-        messages = await database.fetch_all(messages_query, {"note_id": note_id})
-        
-        # Okunmamış mesajları okundu olarak işaretle
-        mark_read_query = """
-            UPDATE chat_messages 
-            SET is_read = true 
-            WHERE note_id = :note_id AND sender_id != :user_id AND is_read = false
-        """
-        await database.execute(mark_read_query, {"note_id": note_id, "user_id": user_id})
-        
-        return {
-            "success": True,
-            "messages": [dict(msg) for msg in messages]
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
+    note = await database.fetch_one(
+        "SELECT patient_id, caregiver_id FROM caregiver_notes WHERE id = :note_id",
+        {"note_id": note_id}
+    )
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
+    if role == 'caregiver' and note["caregiver_id"] != user_id:
+        raise HTTPException(status_code=403, detail="You can only view chat on your own notes")
+    return note
 
 @app.get("/chat/unread_count")
-async def get_unread_message_count(user_id: int, role: str):
-    """Kullanıcının okunmamış mesaj sayısını getir"""
+async def get_unread_message_count(user_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
+    """Kullanıcının okunmamış mesaj sayısını getir (bakımı yapılan sayaçtan)"""
+    require_identity(session, user_id, role)
     if role not in ['doctor', 'caregiver']:
         raise HTTPException(status_code=403, detail="Only doctors and caregivers can check messages")
     
+    counts = await get_unread_counts(user_id)
+    return {
+        "success": True,
+        "unread_count": counts["chat"]
+    }
+
+
+@app.get("/chat/{note_id}")
+async def get_chat_messages(
+    note_id: int,
+    user_id: int,
+    role: str,
+    after_message_id: int = 0,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    session: Optional[Session] = Depends(optional_session)
+):
+    """Note için chat mesajlarını getir.
+
+    after_message_id ile sadece yeni mesajlar eskiden yeniye döner; verilmezse en yeni sayfa,
+    before_id ile de ondan önceki eski mesajlar döner (her iki durumda da liste eskiden yeniye sıralıdır).
+    """
+    require_identity(session, user_id, role)
+    await get_chat_note(note_id, user_id, role)
+    limit = max(1, min(limit or CHAT_PAGE_SIZE, CHAT_PAGE_SIZE))
+    
     try:
-        if role == 'caregiver':
-            # Caregiver sadece kendi notlarındaki okunmamış mesajları sayar
-            query = """
-                SELECT COUNT(*) as unread_count
-                FROM chat_messages cm
-                JOIN caregiver_notes cn ON cm.note_id = cn.id
-                WHERE cn.caregiver_id = :user_id 
-                AND cm.sender_id != :user_id 
-                AND cm.is_read = false
-            """
-        else:  # doctor
-            # Doktor tüm notlardaki okunmamış mesajları sayar
-            query = """
-                SELECT COUNT(*) as unread_count
-                FROM chat_messages cm
-                WHERE cm.sender_id != :user_id 
-                AND cm.is_read = false
-                AND cm.sender_role = 'caregiver'
-            """
+        if after_message_id > 0:
+            messages = [dict(msg) for msg in await db_pool.fetch("chat_messages", note_id, after_message_id, limit)]
+        else:
+            newest = await db_pool.fetch("chat_messages_before", note_id, before_id or 2**31 - 1, limit)
+            messages = [dict(msg) for msg in reversed(newest)]
+        watermarks = {row["user_id"]: row["last_read_message_id"] for row in await db_pool.fetch("chat_read_state", note_id)}
         
-        result = await database.fetch_one(query, {"user_id": user_id})
+        # Okundu bilgisi: satır güncellemek yerine kullanıcının watermark'ını ilerlet
+        if messages and messages[-1]["id"] > watermarks.get(user_id, 0):
+            await advance_chat_watermark(note_id, user_id, role, messages[-1]["id"])
+            watermarks[user_id] = messages[-1]["id"]
+        
+        # Bir mesaj, göndereni dışında biri onu okuduysa okunmuştur
+        for msg in messages:
+            msg["is_read"] = any(
+                reader != msg["sender_id"] and last_read >= msg["id"]
+                for reader, last_read in watermarks.items()
+            )
         
         return {
             "success": True,
-            "unread_count": result["unread_count"] or 0
+            "messages": messages,
+            "first_message_id": messages[0]["id"] if messages else None,
+            "last_message_id": messages[-1]["id"] if messages else after_message_id,
+            # after_message_id ile: daha yeni mesaj var; yoksa: daha eski mesaj var
+            "has_more": len(messages) == limit
         }
+    except PoolTimeout:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.put("/chat/{note_id}/read")
+async def mark_chat_read(note_id: int, user_id: int, role: str, message_id: int, session: Optional[Session] = Depends(optional_session)):
+    """Record that the user has read the note's chat up to message_id (for clients fed by the stream)"""
+    require_identity(session, user_id, role)
+    await get_chat_note(note_id, user_id, role)
+    await advance_chat_watermark(note_id, user_id, role, message_id)
+    return {"success": True, "last_read_message_id": message_id}
+
+
+@app.get("/stream/chat/{note_id}")
+async def stream_chat(request: Request, note_id: int, user_id: int, role: str, session: Optional[Session] = Depends(optional_session)):
+    """Server-Sent Events stream of new messages on a note's chat"""
+    require_identity(session, user_id, role)
+    await get_chat_note(note_id, user_id, role)
+    return sse_response(request, f"chat:{note_id}", "chat_message")
@@ -0,0 +1,120 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+
+class TokenError(Exception):
+    pass
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class KeyRing:
+    """HMAC signing keys; the keys file is re-read when it changes, so keys rotate without a restart.
+
+    Keys file format: {"active": "<kid>", "keys": {"<kid>": "<secret>", ...}}
+    Keep a retired key in the file until tokens signed with it have expired.
+    """
+
+    def __init__(self, keys_file: str = None, secret: str = None, check_interval: float = 1.0):
+        self.keys_file = keys_file
+        self.check_interval = check_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        if not secret and not keys_file:
+            # Birden fazla worker varsa AUTH_SECRET veya AUTH_KEYS_FILE ortak olmalı
+            print("[auth] AUTH_SECRET/AUTH_KEYS_FILE not set, using a random per-process key")
+            secret = secrets.token_hex(32)
+        self._active = "default"
+        self._keys = {"default": secret.encode("utf-8")} if secret else {}
+        self._reload_if_changed()
+
+    def _reload_if_changed(self):
+        if not self.keys_file:
+            return
+        now = time.monotonic()
+        if self._mtime is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.keys_file).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.keys_file, "r") as f:
+                data = json.load(f)
+            keys = {kid: secret.encode("utf-8") for kid, secret in data["keys"].items()}
+            if data["active"] not in keys:
+                raise KeyError(data["active"])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[auth] Could not load {self.keys_file}, keeping previous keys: {e}")
+            return
+        self._keys, self._active, self._mtime = keys, data["active"], mtime
+        print(f"[auth] Loaded {len(keys)} signing key(s), active={self._active}")
+
+    def active(self) -> tuple:
+        self._reload_if_changed()
+        return self._active, self._keys[self._active]
+
+    def get(self, kid: str):
+        self._reload_if_changed()
+        return self._keys.get(kid)
+
+
+def issue_token(keyring: KeyRing, claims: dict, ttl_seconds: int) -> tuple:
+    """Return an HS256-signed JWT carrying claims plus iat/exp, and its expiry timestamp"""
+    kid, key = keyring.active()
+    now = int(time.time())
+    payload = {**claims, "iat": now, "exp": now + ttl_seconds}
+    signing_input = (
+        _b64encode(json.dumps({"alg": "HS256", "typ": "JWT", "kid": kid}, separators=(",", ":")).encode("utf-8"))
+        + "."
+        + _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    )
+    signature = hmac.new(key, signing_input.encode("ascii"), hashlib.sha256).digest()
+    return f"{signing_input}.{_b64encode(signature)}", payload["exp"]
+
+
+def verify_token(keyring: KeyRing, token: str) -> dict:
+    """Check signature and expiry in memory; raises TokenError"""
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64decode(header_b64))
+        signature = _b64decode(signature_b64)
+        signing_input = f"{header_b64}.{payload_b64}".encode("ascii")
+    except (ValueError, TypeError, UnicodeError):
+        raise TokenError("Malformed token")
+    if not isinstance(header, dict) or header.get("alg") != "HS256":
+        raise TokenError("Unsupported token algorithm")
+    if not isinstance(header.get("kid"), str):
+        raise TokenError("Malformed token")
+    key = keyring.get(header["kid"])
+    if key is None:
+        raise TokenError("Unknown signing key")
+    expected = hmac.new(key, signing_input, hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        raise TokenError("Invalid token signature")
+    try:
+        payload = json.loads(_b64decode(payload_b64))
+    except (ValueError, TypeError, UnicodeError):
+        raise TokenError("Malformed token")
+    if not isinstance(payload, dict):
+        raise TokenError("Malformed token")
+    exp = payload.get("exp")
+    if isinstance(exp, bool) or not isinstance(exp, (int, float)):
+        raise TokenError("Malformed token")
+    if exp < time.time():
+        raise TokenError("Token expired")
+    return payload
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""CPU cost of serializing a /read_encrypted-sized list response on each response path.
+
+    python benchmarks/json_serialization.py --rows 500 --payload-bytes 9000 --repeat 20
+
+Compares FastAPI's default path (jsonable_encoder + JSONResponse), fast_json.FastJSONResponse
+(fast_json.dumps, orjson when installed), which /read and /read_encrypted return for list
+responses, and the stream=true path, where Postgres has already produced each row's JSON text
+and the API only frames it. Prints one JSON object with CPU ms per request.
+
+The stream=true figure is API-process CPU only. row_to_json moves the serialization work
+into Postgres, whose CPU is not measured here, so that path is not reported as CPU saved.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+import uuid
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import fast_json
+
+
+class Record(Mapping):
+    """Stand-in for a databases Record: a read-only mapping over one row"""
+
+    def __init__(self, data: dict):
+        self._data = data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+
+def make_rows(count: int, payload_bytes: int) -> list:
+    start = datetime(2026, 1, 1)
+    return [
+        Record({
+            "id": n,
+            "uuid": uuid.uuid4(),
+            "seq_no": n,
+            "patient_id": str(n % 50),
+            "encrypted_data": base64.b64encode(os.urandom(payload_bytes * 3 // 4)).decode("ascii"),
+            "time": start + timedelta(seconds=n)
+        })
+        for n in range(count)
+    ]
+
+
+def fastapi_default(rows):
+    return JSONResponse(jsonable_encoder(rows)).body
+
+
+def fast_encoder(rows):
+    return fast_json.FastJSONResponse(rows).body
+
+
+# Tek bir event loop: istek başına loop kurulumu ölçüme girmesin
+LOOP = asyncio.new_event_loop()
+
+
+def postgres_row_json(row_texts):
+    class Database:
+        async def iterate(self, query, values):
+            for text in row_texts:
+                yield {"row_json": text}
+
+    async def drain():
+        response = await fast_json.stream_rows(Database(), "SELECT", {})
+        return b"".join([chunk.encode("utf-8") async for chunk in response.body_iterator])
+
+    return LOOP.run_until_complete(drain())
+
+
+def measure(fn, arg, repeat: int) -> dict:
+    size = len(fn(arg))
+    start = time.process_time()
+    for _ in range(repeat):
+        fn(arg)
+    cpu_ms = (time.process_time() - start) * 1000 / repeat
+    return {"cpu_ms_per_request": round(cpu_ms, 3), "body_bytes": size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--payload-bytes", type=int, default=9000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows, args.payload_bytes)
+    # row_to_json çıktısının eşdeğeri: satır başına hazır JSON metni
+    row_texts = [json.dumps(jsonable_encoder(row), separators=(",", ":")) for row in rows]
+
+    results = {
+        "fastapi_default": measure(fastapi_default, rows, args.repeat),
+        "fast_json": measure(fast_encoder, rows, args.repeat)
+    }
+    baseline = results["fastapi_default"]["cpu_ms_per_request"]
+    for result in results.values():
+        result["cpu_saved_pct"] = round(100 * (1 - result["cpu_ms_per_request"] / baseline), 1) if baseline else 0.0
+    # Sadece API tarafı; row_to_json maliyeti Postgres'e taşınır ve burada ölçülmez
+    results["stream_row_to_json"] = {
+        **measure(postgres_row_json, row_texts, args.repeat),
+        "note": "API process CPU only; row_to_json runs in Postgres and is not included"
+    }
+
+    print(json.dumps({
+        "rows": args.rows,
+        "payload_bytes": args.payload_bytes,
+        "repeat": args.repeat,
+        "orjson": fast_json.orjson is not None,
+        "results": results
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
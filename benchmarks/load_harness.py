@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""Load harness for the ingest and read paths.
+
+Simulated patients send encrypted packets to /write_encrypted at a fixed rate, built with
+data_generator's packet and envelope code, while reader tasks cycle through the read
+endpoints. At the end one JSON document is printed (and optionally written with --output)
+with per-endpoint throughput, p50/p95/p99 latency and error rate, plus database and table
+size growth measured through asyncpg.
+
+Against the docker-compose stack (Timescale on localhost:5433, API on localhost:8000):
+
+    docker compose up -d timescale api
+    DB_HOST=localhost DB_PORT=5433 DB_USER=postgres DB_PASSWORD=admin DB_NAME=medicaldb \\
+        python benchmarks/load_harness.py --patients 200 --rate 1 --readers 8 --duration 60
+
+Simulated patients use ids from --patient-offset upwards. They have no caregivers, so the
+run does not raise alerts for real users. Sequence numbers continue from
+/get_last_seq_nos, so repeated runs do not collide.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import aiohttp
+import asyncpg
+from dotenv import load_dotenv
+import data_generator
+
+# encrypted_vitals bir hypertable olabilir; boyutu hypertable_size ile, yoksa tablo olarak ölçülür
+SIZE_TABLES = ("encrypted_vitals", "packet_keys", "critical_alerts", "vitals_rollup")
+
+
+class EndpointStats:
+    """Latencies and outcomes of the requests sent to one endpoint"""
+
+    def __init__(self):
+        self.latencies_ms = []
+        self.errors = 0
+        self.statuses = {}
+
+    def record(self, latency_ms: float, status):
+        self.latencies_ms.append(latency_ms)
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if not isinstance(status, int) or status >= 400:
+            self.errors += 1
+
+    def summary(self, elapsed: float) -> dict:
+        latencies = sorted(self.latencies_ms)
+        count = len(latencies)
+
+        def percentile(p):
+            # En yakın sıra yöntemi
+            return round(latencies[max(0, min(count - 1, math.ceil(round(p * count, 9)) - 1))], 3) if count else None
+
+        return {
+            "requests": count,
+            "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0.0,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(latencies[-1], 3) if count else None,
+            "statuses": self.statuses
+        }
+
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.base_url.rstrip("/")
+        self.stats = {}
+        self.measure_from = None
+        self.deadline = None
+        self.patient_ids = [str(args.patient_offset + n) for n in range(args.patients)]
+
+    def endpoint(self, name: str) -> EndpointStats:
+        if name not in self.stats:
+            self.stats[name] = EndpointStats()
+        return self.stats[name]
+
+    async def request(self, session, name: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            async with session.request(method, self.base_url + path, **kwargs) as resp:
+                await resp.read()
+                status = resp.status
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except aiohttp.ClientError as e:
+            status = type(e).__name__
+        if time.monotonic() >= self.measure_from:
+            self.endpoint(name).record((time.perf_counter() - start) * 1000, status)
+
+    async def init_seq_counters(self, session):
+        async with session.get(self.base_url + "/get_last_seq_nos") as resp:
+            resp.raise_for_status()
+            for patient_id, seq in (await resp.json()).items():
+                data_generator.seq_counters[patient_id] = seq
+
+    async def writer(self, session, patient_id: str):
+        interval = 1.0 / self.args.rate
+        # Hastalar aynı anda başlamasın
+        await asyncio.sleep(random.uniform(0, interval))
+        next_send = time.monotonic()
+        while time.monotonic() < self.deadline:
+            packet_dict, padded_bytes = data_generator.generate_random_vitals_for_patient(patient_id)
+            payload = data_generator.build_payload(packet_dict, padded_bytes, self.args.envelope_version)
+            await self.request(session, "POST /write_encrypted", "POST", "/write_encrypted", json=payload)
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+
+    def read_requests(self) -> list:
+        limit = self.args.read_limit
+        return [
+            ("GET /read_encrypted", "/read_encrypted", lambda: {"limit": limit}),
+            ("GET /read_encrypted?patient_id", "/read_encrypted",
+             lambda: {"limit": limit, "patient_id": random.choice(self.patient_ids)}),
+            ("GET /read_encrypted?stream", "/read_encrypted", lambda: {"limit": limit, "stream": "true"}),
+            ("GET /vitals/decrypted", "/vitals/decrypted",
+             lambda: {"limit": limit, "patient_id": random.choice(self.patient_ids)}),
+            ("GET /get_last_seq_nos", "/get_last_seq_nos", lambda: {})
+        ]
+
+    async def reader(self, session):
+        requests = self.read_requests()
+        while time.monotonic() < self.deadline:
+            name, path, params = random.choice(requests)
+            await self.request(session, name, "GET", path, params=params())
+            if self.args.read_interval:
+                await asyncio.sleep(self.args.read_interval)
+
+    async def run(self) -> dict:
+        timeout = aiohttp.ClientTimeout(total=self.args.timeout)
+        connector = aiohttp.TCPConnector(limit=self.args.connections)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            await self.init_seq_counters(session)
+            started = time.monotonic()
+            self.measure_from = started + self.args.warmup
+            self.deadline = self.measure_from + self.args.duration
+            tasks = [self.writer(session, patient_id) for patient_id in self.patient_ids]
+            tasks += [self.reader(session) for _ in range(self.args.readers)]
+            tasks.append(self.measure_db_at_start())
+            *_, db_before = await asyncio.gather(*tasks)
+            elapsed = time.monotonic() - self.measure_from
+        db_after = await measure_db(self.args.dsn)
+
+        return {
+            "config": {
+                "base_url": self.base_url,
+                "patients": self.args.patients,
+                "rate_per_patient": self.args.rate,
+                "readers": self.args.readers,
+                "read_limit": self.args.read_limit,
+                "envelope_version": self.args.envelope_version,
+                "warmup_seconds": self.args.warmup,
+                "duration_seconds": self.args.duration
+            },
+            "elapsed_seconds": round(elapsed, 3),
+            "endpoints": {name: stats.summary(elapsed) for name, stats in sorted(self.stats.items())},
+            "db": db_growth(db_before, db_after)
+        }
+
+
+    async def measure_db_at_start(self) -> dict:
+        # Isınma sırasında yazılanlar büyümeye sayılmasın
+        await asyncio.sleep(max(0.0, self.measure_from - time.monotonic()))
+        return await measure_db(self.args.dsn)
+
+
+async def measure_db(dsn: str) -> dict:
+    """Database and table sizes in bytes; None when the database is unreachable"""
+    if not dsn:
+        return None
+    try:
+        connection = await asyncpg.connect(dsn)
+    except (OSError, asyncpg.PostgresError) as e:
+        print(f"[!] Could not connect for size measurements: {e}", file=sys.stderr)
+        return None
+    try:
+        sizes = {"database": await connection.fetchval("SELECT pg_database_size(current_database())")}
+        timescale = await connection.fetchval("SELECT count(*) > 0 FROM pg_extension WHERE extname = 'timescaledb'")
+        for table in SIZE_TABLES:
+            if not await connection.fetchval("SELECT to_regclass($1) IS NOT NULL", table):
+                continue
+            is_hypertable = timescale and await connection.fetchval(
+                "SELECT count(*) > 0 FROM timescaledb_information.hypertables WHERE hypertable_name = $1", table
+            )
+            if is_hypertable:
+                sizes[table] = await connection.fetchval("SELECT hypertable_size($1::regclass)", table)
+            else:
+                sizes[table] = await connection.fetchval("SELECT pg_total_relation_size($1::regclass)", table)
+        return sizes
+    finally:
+        await connection.close()
+
+
+def db_growth(before: dict, after: dict) -> dict:
+    if before is None or after is None:
+        return None
+    return {
+        key: {"before": before[key], "after": after.get(key), "growth": (after.get(key) or 0) - (before[key] or 0)}
+        for key in before
+    }
+
+
+def default_dsn() -> str:
+    load_dotenv()
+    if not os.getenv("DB_HOST"):
+        return None
+    return (
+        f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+        f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--dsn", default=default_dsn(), help="Postgres DSN for size growth (default: DB_* env)")
+    parser.add_argument("--patients", type=int, default=50, help="simulated patients, one writer each")
+    parser.add_argument("--patient-offset", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=1.0, help="packets per second per patient")
+    parser.add_argument("--readers", type=int, default=4, help="concurrent read loops")
+    parser.add_argument("--read-interval", type=float, default=0.0, help="pause between reads per reader")
+    parser.add_argument("--read-limit", type=int, default=50)
+    parser.add_argument("--envelope-version", type=int, default=data_generator.ENVELOPE_VERSION, choices=(1, 2))
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds excluded from the results")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--connections", type=int, default=100, help="HTTP connection pool size")
+    parser.add_argument("--timeout", type=float, default=10.0, help="per-request timeout in seconds")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(Harness(args).run())
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,24 @@
 from Crypto.Cipher import AES
 import base64
+import datetime
 import os
 import json
+import struct
 
 # 32 bytes key for AES256
 KEY = os.environ.get('AES_KEY', 'thisisaverysecretkey1234567890ab').encode('utf-8')
 NONCE = os.environ.get('AES_NONCE', 'thisisgcmnonce!').encode('utf-8')  # 12 bytes for GCM
 
+# Envelope v2: version(1) | nonce(12) | tag(16) | ciphertext
+# Legacy (v1) envelopes are base64 text of a JSON dict, so their first decoded byte is '{'
+ENVELOPE_V2 = 2
+V2_NONCE_LEN = 12
+V2_TAG_LEN = 16
+
+# Binary vitals record: uuid, seq_no, heart_rate, oxygen_level, temp*10, timestamp (µs) + patient_id utf-8
+_RECORD = struct.Struct('!16sQHBhq')
+_EPOCH = datetime.datetime(1970, 1, 1)
+
 def encrypt_data(data_bytes: bytes) -> str:
     cipher = AES.new(KEY, AES.MODE_GCM, nonce=NONCE)
     ct_bytes, tag = cipher.encrypt_and_digest(data_bytes)
@@ -17,11 +29,81 @@ def encrypt_data(data_bytes: bytes) -> str:
     }
     return base64.b64encode(json.dumps(payload).encode('utf-8')).decode('utf-8')
 
-def decrypt_data(enc_data: str) -> str:
-    payload = json.loads(base64.b64decode(enc_data).decode('utf-8'))
+def encode_vitals_record(packet: dict) -> bytes:
+    """Pack a generator packet dict into the compact binary record"""
+    timestamp = datetime.datetime.fromisoformat(packet['timestamp'])
+    micros = (timestamp - _EPOCH) // datetime.timedelta(microseconds=1)
+    return _RECORD.pack(
+        bytes.fromhex(packet['uuid'].replace('-', '')),
+        packet['seq_no'],
+        packet['heart_rate'],
+        packet['oxygen_level'],
+        round(packet['temp'] * 10),
+        micros
+    ) + str(packet['patient_id']).encode('utf-8')
+
+def decode_vitals_record(record: bytes) -> dict:
+    raw_uuid, seq_no, heart_rate, oxygen_level, temp, micros = _RECORD.unpack_from(record)
+    hex_uuid = raw_uuid.hex()
+    return {
+        'uuid': f'{hex_uuid[:8]}-{hex_uuid[8:12]}-{hex_uuid[12:16]}-{hex_uuid[16:20]}-{hex_uuid[20:]}',
+        'seq_no': seq_no,
+        'patient_id': record[_RECORD.size:].decode('utf-8'),
+        'heart_rate': heart_rate,
+        'oxygen_level': oxygen_level,
+        'temp': temp / 10,
+        'timestamp': (_EPOCH + datetime.timedelta(microseconds=micros)).isoformat()
+    }
+
+def encrypt_packet(packet: dict) -> bytes:
+    """Encrypt a packet dict into a v2 binary envelope with a fresh random nonce"""
+    nonce = os.urandom(V2_NONCE_LEN)
+    cipher = AES.new(KEY, AES.MODE_GCM, nonce=nonce)
+    ct_bytes, tag = cipher.encrypt_and_digest(encode_vitals_record(packet))
+    return bytes([ENVELOPE_V2]) + nonce + tag + ct_bytes
+
+def envelope_version(enc_data) -> int:
+    """Detect the envelope version of raw bytes or base64 text"""
+    if isinstance(enc_data, (bytes, bytearray, memoryview)):
+        first = bytes(enc_data[:1])
+    else:
+        first = base64.b64decode(enc_data[:4])[:1]
+    return ENVELOPE_V2 if first == bytes([ENVELOPE_V2]) else 1
+
+def _decrypt_v2(raw: bytes) -> bytes:
+    nonce = raw[1:1 + V2_NONCE_LEN]
+    tag = raw[1 + V2_NONCE_LEN:1 + V2_NONCE_LEN + V2_TAG_LEN]
+    ct = raw[1 + V2_NONCE_LEN + V2_TAG_LEN:]
+    cipher = AES.new(KEY, AES.MODE_GCM, nonce=nonce)
+    return cipher.decrypt_and_verify(ct, tag)
+
+def _envelope_bytes(enc_data) -> bytes:
+    if isinstance(enc_data, (bytes, bytearray, memoryview)):
+        raw = bytes(enc_data)
+        if raw[:1] == bytes([ENVELOPE_V2]):
+            return raw
+        enc_data = raw.decode('utf-8')
+    return base64.b64decode(enc_data)
+
+def _decrypt_v1(raw: bytes) -> str:
+    payload = json.loads(raw.decode('utf-8'))
     nonce = base64.b64decode(payload['nonce'])
     tag = base64.b64decode(payload['tag'])
     ct = base64.b64decode(payload['ciphertext'])
     cipher = AES.new(KEY, AES.MODE_GCM, nonce=nonce)
     pt = cipher.decrypt_and_verify(ct, tag)
     return pt.decode('utf-8')
+
+def decrypt_data(enc_data) -> str:
+    """Decrypt a v1 or v2 envelope; v2 records are returned as JSON text"""
+    raw = _envelope_bytes(enc_data)
+    if raw[:1] == bytes([ENVELOPE_V2]):
+        return json.dumps(decode_vitals_record(_decrypt_v2(raw)))
+    return _decrypt_v1(raw)
+
+def decrypt_vitals(enc_data) -> dict:
+    """Decrypt a packet and return the vitals dict without the 'X' padding"""
+    raw = _envelope_bytes(enc_data)
+    if raw[:1] == bytes([ENVELOPE_V2]):
+        return decode_vitals_record(_decrypt_v2(raw))
+    return json.loads(_decrypt_v1(raw).rstrip('X'))
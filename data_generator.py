@@ -5,14 +5,19 @@ import time
 import json
 import uuid
 import os
+import base64
 import datetime
-from crypto_utils import encrypt_data
+from crypto_utils import encrypt_data, encrypt_packet
+from retry_log import RetryLog
 
 API_URL = "http://localhost:8000/write_encrypted"
 SEQ_INIT_URL = "http://localhost:8000/get_last_seq_nos"
 PATIENTS_URL = "http://localhost:8000/get_patients"
 RETRY_DIR = "retry_queue"
-os.makedirs(RETRY_DIR, exist_ok=True)
+# 2: compact binary envelope (default), 1: legacy JSON envelope padded to 5120 bytes
+ENVELOPE_VERSION = int(os.getenv("ENVELOPE_VERSION", "2"))
+# main() içinde açılır; modülü import etmek (ör. load harness) retry_queue/ oluşturmaz
+retry_log = None
 
 seq_counters = {}
 patient_ids = []
@@ -98,10 +103,14 @@ def generate_random_vitals_for_patient(patient_id):
     padded_bytes = json_bytes + b'X' * padding_len
     return packet_dict, padded_bytes
 
-async def send_vitals(session, packet_dict, padded_bytes):
-    encrypted = encrypt_data(padded_bytes)
+def build_payload(packet_dict, padded_bytes, envelope_version=None):
+    """Encrypt a generated packet into the /write_encrypted request body"""
+    if (envelope_version or ENVELOPE_VERSION) == 1:
+        encrypted = encrypt_data(padded_bytes)
+    else:
+        encrypted = base64.b64encode(encrypt_packet(packet_dict)).decode('utf-8')
 
-    payload = {
+    return {
         "uuid": packet_dict["uuid"],
         "seq_no": packet_dict["seq_no"],
         "patient_id": packet_dict["patient_id"],
@@ -109,6 +118,9 @@ async def send_vitals(session, packet_dict, padded_bytes):
         "late": False  # default for live packets
     }
 
+async def send_vitals(session, packet_dict, padded_bytes):
+    payload = build_payload(packet_dict, padded_bytes)
+
     try:
         async with session.post(API_URL, json=payload, timeout=1) as resp:
             if resp.status != 200:
@@ -116,11 +128,9 @@ async def send_vitals(session, packet_dict, padded_bytes):
             await resp.text()
     except Exception as e:
         print(f"[!] Send failed (seq={packet_dict['seq_no']}): {e}")
-        fallback_path = os.path.join(RETRY_DIR, f"{packet_dict['uuid']}.json")
         try:
-            with open(fallback_path, "w") as f:
-                json.dump(payload, f)
-            print(f"→ Saved to retry queue: {fallback_path}")
+            retry_log.append(payload)
+            print(f"→ Queued for retry: {packet_dict['uuid']}")
         except Exception as file_err:
             print(f"[!!] Could not save to fallback queue: {file_err}")
 
@@ -139,13 +149,22 @@ async def run_generator(period=1.0):
                     print(f"Sent seq_no={packet_dict['seq_no']} uuid={packet_dict['uuid']} ({elapsed:.2f}s)")
 
             
+            # Tur sonunda retry kuyruğunu diske yaz (toplu fsync)
+            retry_log.sync()
             # Period kadar bekle
             await asyncio.sleep(period)
 
-if __name__ == "__main__":
+def main():
+    global retry_log
+    retry_log = RetryLog(RETRY_DIR)
     try:
         asyncio.run(initialize_seq_counters())
         asyncio.run(get_patient_ids())
         asyncio.run(run_generator(period=1.0))  # Her 2 saniyede tüm hastalar için veri generate et
     except KeyboardInterrupt:
         print("Stopped generator.")
+    finally:
+        retry_log.close()
+
+if __name__ == "__main__":
+    main()
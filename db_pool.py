@@ -0,0 +1,148 @@
+from collections import deque
+from contextlib import asynccontextmanager
+import asyncio
+import time
+import asyncpg
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class StatementStats:
+    """Latency counters for one named statement, with a window of recent samples for percentiles"""
+
+    def __init__(self, window: int = 512):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self._recent = deque(maxlen=window)
+
+    def record(self, elapsed_ms: float, failed: bool = False):
+        self.calls += 1
+        self.errors += failed
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self._recent.append(elapsed_ms)
+
+    def stats(self) -> dict:
+        recent = sorted(self._recent)
+
+        def percentile(p):
+            return round(recent[min(len(recent) - 1, int(p * len(recent)))], 3) if recent else 0.0
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "max_ms": round(self.max_ms, 3)
+        }
+
+
+class DbPool:
+    """asyncpg pool for the fixed hot-path statements.
+
+    Statements are registered once by name with $n placeholders. Because the SQL text never
+    changes, asyncpg prepares each one on first use per connection and reuses it from its
+    statement cache afterwards, so later calls only send Bind/Execute.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 2, max_size: int = 10,
+                 acquire_timeout: float = 5.0, statement_cache_size: int = 100):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.statement_cache_size = statement_cache_size
+        self.statements = {}
+        self.acquired = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.timeouts = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self._stats = {}
+        self._pool = None
+
+    def register(self, name: str, sql: str):
+        self.statements[name] = sql
+        self._stats[name] = StatementStats()
+
+    async def connect(self):
+        self._pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            statement_cache_size=self.statement_cache_size
+        )
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    @asynccontextmanager
+    async def acquire(self, timeout: float = None):
+        """Borrow a connection, raising PoolTimeout if none frees up within timeout seconds"""
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            connection = await self._pool.acquire(timeout=timeout or self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PoolTimeout(f"No database connection available within {timeout or self.acquire_timeout}s")
+        finally:
+            self.waiting -= 1
+        waited_ms = (time.perf_counter() - start) * 1000
+        self.acquired += 1
+        self.wait_total_ms += waited_ms
+        self.wait_max_ms = max(self.wait_max_ms, waited_ms)
+        self.in_use += 1
+        try:
+            yield connection
+        finally:
+            self.in_use -= 1
+            await self._pool.release(connection)
+
+    async def _run(self, method: str, name: str, args):
+        async with self.acquire() as connection:
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = await getattr(connection, method)(self.statements[name], *args)
+                failed = False
+                return result
+            finally:
+                self._stats[name].record((time.perf_counter() - start) * 1000, failed)
+
+    async def fetch(self, name: str, *args) -> list:
+        return await self._run("fetch", name, args)
+
+    async def fetchrow(self, name: str, *args):
+        return await self._run("fetchrow", name, args)
+
+    async def execute(self, name: str, *args) -> str:
+        return await self._run("execute", name, args)
+
+    def stats(self) -> dict:
+        size = self._pool.get_size() if self._pool is not None else 0
+        idle = self._pool.get_idle_size() if self._pool is not None else 0
+        return {
+            "pool": {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": size,
+                "idle": idle,
+                "in_use": self.in_use,
+                "saturation": round(self.in_use / self.max_size, 3),
+                "waiting": self.waiting,
+                "acquired": self.acquired,
+                "timeouts": self.timeouts,
+                "wait_mean_ms": round(self.wait_total_ms / self.acquired, 3) if self.acquired else 0.0,
+                "wait_max_ms": round(self.wait_max_ms, 3)
+            },
+            "statements": {name: stats.stats() for name, stats in self._stats.items()}
+        }
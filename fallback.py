@@ -1,24 +1,132 @@
-import aiohttp, asyncio, os, json
+import aiohttp, asyncio, os, json, random, time
+from retry_log import RetryLog
 
 RETRY_DIR = "retry_queue"
 FALLBACK_URL = "http://localhost:8000/write_fallback"
+BATCH_URL = "http://localhost:8000/write_encrypted_batch"
+REPLAY_CONCURRENCY = int(os.getenv("REPLAY_CONCURRENCY", "4"))
+REPLAY_BATCH = int(os.getenv("REPLAY_BATCH", "200"))
+# Bir turda logdan okunan kayıt sayısı; checkpoint tur sonunda ilerler
+READ_CHUNK = REPLAY_BATCH * REPLAY_CONCURRENCY * 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+MAX_ATTEMPTS = 8
+REPORT_INTERVAL = 5.0
+
+retry_log = RetryLog(RETRY_DIR)
+
+class ReplayStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.sent = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.retries = 0
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < REPORT_INTERVAL:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        print(
+            f"[replay] backlog={retry_log.backlog_bytes()}B sent={self.sent} "
+            f"rate={self.sent / elapsed:.1f} pkt/s inserted={self.inserted} "
+            f"duplicates={self.duplicates} rejected={self.rejected} retries={self.retries}"
+        )
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+async def post_batch(session, packets, stats) -> bool:
+    """Send one batch until it is accepted; returns False if the API stays unavailable"""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            async with session.post(BATCH_URL, json=packets, timeout=10) as resp:
+                if resp.status == 200:
+                    result = await resp.json()
+                    stats.sent += len(packets)
+                    stats.inserted += result["inserted"]
+                    stats.duplicates += result["duplicates"]
+                    stats.rejected += result["rejected"]
+                    for item in result["results"]:
+                        if item["status"] == "rejected":
+                            print(f"Dropped rejected packet {item['uuid']}: {item.get('detail')}")
+                    return True
+                if 400 <= resp.status < 500 and resp.status != 429:
+                    # Tek bozuk paket bütün batch'i düşürmesin: ikiye böl
+                    if len(packets) == 1:
+                        print(f"Dropped packet {packets[0].get('uuid')}: HTTP {resp.status}")
+                        stats.sent += 1
+                        stats.rejected += 1
+                        return True
+                    middle = len(packets) // 2
+                    return (await post_batch(session, packets[:middle], stats)
+                            and await post_batch(session, packets[middle:], stats))
+                print(f"Retry failed: {resp.status}")
+        except Exception as e:
+            print("Retry error:", e)
+        stats.retries += 1
+        await asyncio.sleep(backoff_delay(attempt))
+    return False
+
+async def replay_lane(session, packets, stats) -> bool:
+    """Send one lane's packets in order, one batch at a time"""
+    for i in range(0, len(packets), REPLAY_BATCH):
+        if not await post_batch(session, packets[i:i + REPLAY_BATCH], stats):
+            return False
+        stats.report()
+    return True
+
+def plan_lanes(records) -> list:
+    """Split packets into lanes; each patient stays in one lane, ordered by seq_no"""
+    by_patient = {}
+    for _, data in records:
+        data['late'] = True
+        by_patient.setdefault(data['patient_id'], []).append(data)
+    lanes = [[] for _ in range(REPLAY_CONCURRENCY)]
+    for n, patient_id in enumerate(sorted(by_patient)):
+        lanes[n % REPLAY_CONCURRENCY].extend(sorted(by_patient[patient_id], key=lambda p: p['seq_no']))
+    return [lane for lane in lanes if lane]
+
+async def retry_legacy_files(session):
+    """Drain packets left as one-file-per-packet by older generator versions"""
+    for fname in os.listdir(RETRY_DIR):
+        if not fname.endswith(".json"):
+            continue
+        path = os.path.join(RETRY_DIR, fname)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            data['late'] = True
+            async with session.post(FALLBACK_URL, json=data, timeout=2) as resp:
+                if resp.status == 200:
+                    print(f"Retried {data['uuid']} successfully.")
+                    os.remove(path)
+                else:
+                    print(f"Retry failed: {resp.status}")
+        except Exception as e:
+            print("Retry error:", e)
 
 async def retry_failed_packets():
+    stats = ReplayStats()
     async with aiohttp.ClientSession() as session:
-        for fname in os.listdir(RETRY_DIR):
-            path = os.path.join(RETRY_DIR, fname)
-            try:
-                with open(path, "r") as f:
-                    data = json.load(f)
-                data['late'] = True
-                async with session.post(FALLBACK_URL, json=data, timeout=2) as resp:
-                    if resp.status == 200:
-                        print(f"Retried {data['uuid']} successfully.")
-                        os.remove(path)
-                    else:
-                        print(f"Retry failed: {resp.status}")
-            except Exception as e:
-                print("Retry error:", e)
+        await retry_legacy_files(session)
+        while True:
+            records, position = retry_log.read(READ_CHUNK)
+            if not records:
+                break
+            lanes = plan_lanes(records)
+            results = await asyncio.gather(*(replay_lane(session, lane, stats) for lane in lanes))
+            if not all(results):
+                # Checkpoint ilerlemez; gönderilmiş olanlar sonraki turda API tarafından tekrar olarak elenir
+                break
+            retry_log.commit(position)
+    if stats.sent:
+        stats.report(force=True)
 
 async def run_loop():
     while True:
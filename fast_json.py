@@ -0,0 +1,101 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from uuid import UUID
+import json
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# orjson isteğe bağlıdır; kurulu değilse standart json kullanılır
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+STREAM_CHUNK_BYTES = 64 * 1024
+_EMPTY = object()
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if hasattr(obj, "keys"):
+        # databases / asyncpg Record
+        return {key: obj[key] for key in obj.keys()}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content) -> str:
+    """Serialize to a JSON string, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default).decode("utf-8")
+    return json.dumps(content, default=_default, separators=(",", ":"))
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with dumps(); endpoints return it to skip jsonable_encoder"""
+
+    def render(self, content) -> bytes:
+        return dumps(content).encode("utf-8")
+
+
+async def prefetch(rows):
+    """Start an async iterator and fetch its first item now.
+
+    Query errors then surface before a StreamingResponse is built, while an error status
+    can still be sent. Returns an iterator that yields the first item and then the rest.
+    """
+    rows = rows.__aiter__()
+    try:
+        first = await rows.__anext__()
+    except StopAsyncIteration:
+        first = _EMPTY
+
+    async def rest():
+        if first is _EMPTY:
+            return
+        try:
+            yield first
+            async for row in rows:
+                yield row
+        finally:
+            await rows.aclose()
+
+    return rest()
+
+
+async def stream_rows(database, query: str, values: dict, prefix: str = "[", suffix=None,
+                      track: tuple = (), headers: dict = None) -> StreamingResponse:
+    """Stream a query's rows as a JSON array that Postgres serializes with row_to_json.
+
+    Rows reach the client as the text Postgres produced, so no Record or dict is built per
+    row. track names result columns that are also fetched as values; suffix(count, last) gets
+    the row count and the last row's tracked values (or None) and returns the closing text.
+    The first row is fetched before returning, so query errors raise here.
+    """
+    tracked = "".join(f", t.{column}" for column in track)
+    wrapped = f"SELECT row_to_json(t)::text AS row_json{tracked} FROM ({query}) t"
+    rows = await prefetch(database.iterate(wrapped, values))
+
+    async def body():
+        count = 0
+        last = None
+        chunk = [prefix]
+        size = len(prefix)
+        async for row in rows:
+            text = row["row_json"]
+            chunk.append("," + text if count else text)
+            size += len(text) + 1
+            count += 1
+            if track:
+                last = {column: row[column] for column in track}
+            if size >= STREAM_CHUNK_BYTES:
+                yield "".join(chunk)
+                chunk = []
+                size = 0
+        chunk.append(suffix(count, last) if suffix else "]")
+        yield "".join(chunk)
+
+    return StreamingResponse(body(), media_type="application/json", headers=headers)
@@ -40,9 +40,13 @@ export default function ChatModal({ visible, onClose, noteId, noteTitle, patient
   const [newMessage, setNewMessage] = useState('');
   const [loading, setLoading] = useState(false);
   const [sending, setSending] = useState(false);
+  const [hasOlder, setHasOlder] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [currentUserId, setCurrentUserId] = useState<number | null>(null);
   const [currentUserRole, setCurrentUserRole] = useState<string | null>(null);
   const scrollViewRef = useRef<ScrollView>(null);
+  // Eski mesajlar başa eklenince liste sona kaydırılmaz
+  const skipScrollRef = useRef(false);
 
   useEffect(() => {
     if (visible) {
@@ -58,6 +62,10 @@ export default function ChatModal({ visible, onClose, noteId, noteTitle, patient
 
   useEffect(() => {
     // Scroll to bottom when new messages arrive
+    if (skipScrollRef.current) {
+      skipScrollRef.current = false;
+      return;
+    }
     if (messages.length > 0) {
       setTimeout(() => {
         scrollViewRef.current?.scrollToEnd({ animated: true });
@@ -76,27 +84,63 @@ export default function ChatModal({ visible, onClose, noteId, noteTitle, patient
     }
   };
 
-  const loadMessages = async () => {
+  const fetchMessagePage = async (params: string) => {
+    const response = await fetch(
+      `${API_BASE_URL}/chat/${noteId}?user_id=${currentUserId}&role=${currentUserRole}&${params}`
+    );
+    const data = await response.json();
+    if (!response.ok || !data.success) {
+      throw new Error(data.detail || 'Failed to load messages');
+    }
+    return data;
+  };
+
+  const loadMessages = async (afterMessageId: number = 0) => {
     if (!currentUserId || !currentUserRole) return;
     
     try {
-      setLoading(true);
-      const response = await fetch(`${API_BASE_URL}/chat/${noteId}?user_id=${currentUserId}&role=${currentUserRole}`);
-      const data = await response.json();
-
-      if (response.ok && data.success) {
+      setLoading(afterMessageId === 0);
+      if (afterMessageId === 0) {
+        // İlk yükleme en yeni sayfayı getirir; daha eskileri loadOlderMessages ile gelir
+        const data = await fetchMessagePage('');
         setMessages(data.messages);
-      } else {
-        Alert.alert('Error', data.detail || 'Failed to load messages');
+        setHasOlder(data.has_more);
+        return;
+      }
+      // Sadece yeni mesajlar gelir; has_more bitene kadar sayfalar mevcut listeye eklenir
+      let after = afterMessageId;
+      let hasMore = true;
+      while (hasMore) {
+        const data = await fetchMessagePage(`after_message_id=${after}`);
+        setMessages(prev => [...prev, ...data.messages]);
+        after = data.last_message_id;
+        hasMore = data.has_more;
       }
     } catch (error) {
       console.error('Load messages error:', error);
-      Alert.alert('Error', 'Something went wrong while loading messages');
+      Alert.alert('Error', error instanceof Error ? error.message : 'Something went wrong while loading messages');
     } finally {
       setLoading(false);
     }
   };
 
+  const loadOlderMessages = async () => {
+    if (!currentUserId || !currentUserRole || messages.length === 0) return;
+
+    try {
+      setLoadingOlder(true);
+      const data = await fetchMessagePage(`before_id=${messages[0].id}`);
+      skipScrollRef.current = true;
+      setMessages(prev => [...data.messages, ...prev]);
+      setHasOlder(data.has_more);
+    } catch (error) {
+      console.error('Load older messages error:', error);
+      Alert.alert('Error', error instanceof Error ? error.message : 'Something went wrong while loading messages');
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
   const sendMessage = async () => {
     if (!newMessage.trim() || !currentUserId || !currentUserRole) {
       return;
@@ -117,7 +161,7 @@ export default function ChatModal({ visible, onClose, noteId, noteTitle, patient
 
       if (response.ok && result.success) {
         setNewMessage('');
-        loadMessages(); // Reload messages
+        loadMessages(messages.length > 0 ? messages[messages.length - 1].id : 0); // Fetch only new messages
       } else {
         Alert.alert('Error', result.detail || 'Failed to send message');
       }
@@ -228,7 +272,22 @@ export default function ChatModal({ visible, onClose, noteId, noteTitle, patient
               <Text style={styles.loadingText}>Loading messages...</Text>
             </View>
           ) : messages.length > 0 ? (
-            messages.map((message, index) => renderMessage(message, index))
+            <>
+              {hasOlder && (
+                <TouchableOpacity
+                  style={styles.loadOlderButton}
+                  onPress={loadOlderMessages}
+                  disabled={loadingOlder}
+                >
+                  {loadingOlder ? (
+                    <ActivityIndicator size="small" color="#2980b9" />
+                  ) : (
+                    <Text style={styles.loadOlderText}>Load earlier messages</Text>
+                  )}
+                </TouchableOpacity>
+              )}
+              {messages.map((message, index) => renderMessage(message, index))}
+            </>
           ) : (
             <View style={styles.emptyContainer}>
               <Ionicons name="chatbubbles-outline" size={64} color="#bdc3c7" />
@@ -309,6 +368,16 @@ const styles = StyleSheet.create({
     padding: 15,
     paddingBottom: 20,
   },
+  loadOlderButton: {
+    alignSelf: 'center',
+    paddingVertical: 8,
+    paddingHorizontal: 16,
+    marginBottom: 10,
+  },
+  loadOlderText: {
+    fontSize: 14,
+    color: '#2980b9',
+  },
   loadingContainer: {
     flex: 1,
     justifyContent: 'center',
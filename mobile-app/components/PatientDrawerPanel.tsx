@@ -50,14 +50,24 @@ export default function PatientDrawerPanel({
           const patientsWithAlerts = await Promise.all(
             data.map(async (patient: PatientWithAlert) => {
               try {
-                // Her hasta için en yüksek care level'ı al
-                const notesResponse = await fetch(
-                  `${API_BASE_URL}/caregiver_notes/by_patient/${patient.id}?user_id=${userId}&role=${role}`
-                );
-                const notes = await notesResponse.json();
+                // Her hasta için en yüksek care level'ı al; notlar sayfalıdır, X-Next-Cursor izlenir
+                let maxCareLevel = 0;
+                let cursor: string | null = null;
+                do {
+                  const cursorParam: string = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+                  const notesResponse: Response = await fetch(
+                    `${API_BASE_URL}/caregiver_notes/by_patient/${patient.id}?user_id=${userId}&role=${role}${cursorParam}`
+                  );
+                  const notes = await notesResponse.json();
+                  if (!notesResponse.ok || !Array.isArray(notes)) break;
+                  for (const note of notes) {
+                    maxCareLevel = Math.max(maxCareLevel, note.care_level || 0);
+                  }
+                  cursor = notesResponse.headers.get('X-Next-Cursor');
+                  // 5 en yüksek seviye; daha eski sayfalara bakmaya gerek yok
+                } while (cursor && maxCareLevel < 5);
                 
-                if (Array.isArray(notes) && notes.length > 0) {
-                  const maxCareLevel = Math.max(...notes.map((note: any) => note.care_level || 0));
+                if (maxCareLevel > 0) {
                   return {
                     ...patient,
                     hasHighPriorityNotes: maxCareLevel >= 4, // Care level 4-5 kritik
@@ -0,0 +1,71 @@
+import asyncio
+import functools
+import json
+import asyncpg
+
+
+class PgListener:
+    """Keeps one LISTEN connection per worker and hands NOTIFY payloads to local async handlers"""
+
+    def __init__(self, dsn: str, handlers: dict, reconnect_delay: float = 2.0):
+        self.dsn = dsn
+        self.handlers = handlers
+        self.reconnect_delay = reconnect_delay
+        self.received = 0
+        self._connection = None
+        self._task = None
+        self._handler_tasks = set()
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None and not self._connection.is_closed()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for task in list(self._handler_tasks):
+            task.cancel()
+        if self.connected:
+            await self._connection.close()
+
+    async def _run(self):
+        while True:
+            closed = asyncio.Event()
+            try:
+                self._connection = await asyncpg.connect(self.dsn)
+                self._connection.add_termination_listener(lambda conn: closed.set())
+                for channel in self.handlers:
+                    await self._connection.add_listener(channel, self._dispatch)
+                print(f"PgListener listening on {', '.join(self.handlers)}")
+                await closed.wait()
+                print("PgListener connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"PgListener could not connect: {e}")
+            self._connection = None
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _dispatch(self, connection, pid, channel, payload):
+        self.received += 1
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            print(f"PgListener ignored malformed payload on {channel}")
+            return
+        # Referans tutulur; aksi halde görev çöp toplanabilir ve hatası kaybolur
+        task = asyncio.create_task(self.handlers[channel](event))
+        self._handler_tasks.add(task)
+        task.add_done_callback(functools.partial(self._handler_done, channel))
+
+    def _handler_done(self, channel, task):
+        self._handler_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"PgListener handler for {channel} failed: {task.exception()!r}")
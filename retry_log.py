@@ -0,0 +1,205 @@
+import json
+import os
+import struct
+import time
+import zlib
+
+# Her kayıt: uzunluk (4 byte) | crc32 (4 byte) | JSON payload
+RECORD_HEADER = struct.Struct("!II")
+SEGMENT_SUFFIX = ".seg"
+CHECKPOINT_FILE = "checkpoint.json"
+# Bozuk bir kayıttan sonra yeniden senkronizasyon ararken kabul edilen en büyük kayıt
+MAX_RECORD_BYTES = 1024 * 1024
+
+
+def _fsync_dir(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class RetryLog:
+    """Segmented append-only log of packets waiting to be replayed.
+
+    One process appends (data_generator), one process replays and checkpoints (fallback).
+    A record is acknowledged once sync() has returned. The writer only creates a new
+    segment after the previous one is synced and closed, so any segment older than the
+    newest is final and a torn record at its tail can be skipped safely. A corrupt record with
+    valid records after it is logged and skipped; reading resumes at the next valid record.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024,
+                 sync_every: int = 200, sync_interval: float = 0.5):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        os.makedirs(directory, exist_ok=True)
+        self._file = None
+        self._segment_id = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    # --- segments ---
+
+    def _segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.directory, f"{segment_id:012d}{SEGMENT_SUFFIX}")
+
+    def segments(self) -> list:
+        ids = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    ids.append(int(name[:-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(ids)
+
+    # --- writer ---
+
+    def _open_new_segment(self):
+        segments = self.segments()
+        self._segment_id = segments[-1] + 1 if segments else 1
+        self._file = open(self._segment_path(self._segment_id), "ab")
+        _fsync_dir(self.directory)
+
+    def append(self, payload: dict):
+        """Buffer one record; it is durable after the next sync()"""
+        if self._file is None:
+            # Yeniden başlatmada her zaman yeni segment açılır; eski segmentin yarım kuyruğu atlanır
+            self._open_new_segment()
+        data = json.dumps(payload).encode("utf-8")
+        self._file.write(RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data)
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+            self.sync()
+        if self._file.tell() >= self.segment_bytes:
+            self._rotate()
+
+    def sync(self):
+        if self._file is None or self._unsynced == 0:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _rotate(self):
+        self.sync()
+        self._file.close()
+        self._open_new_segment()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    # --- reader ---
+
+    def load_checkpoint(self) -> tuple:
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE), "r") as f:
+                data = json.load(f)
+            return data["segment"], data["offset"]
+        except (FileNotFoundError, ValueError, KeyError):
+            segments = self.segments()
+            return (segments[0] if segments else 0), 0
+
+    def commit(self, position: tuple):
+        """Durably record that everything before position has been replayed"""
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": position[0], "offset": position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _fsync_dir(self.directory)
+        self._delete_replayed(position[0])
+
+    def _delete_replayed(self, checkpoint_segment: int):
+        for segment_id in self.segments():
+            if segment_id < checkpoint_segment:
+                os.remove(self._segment_path(segment_id))
+
+    def read(self, max_records: int, position: tuple = None) -> tuple:
+        """Return ([(position_after, payload), ...], next_position) starting at position or the checkpoint"""
+        segment_id, offset = position or self.load_checkpoint()
+        records = []
+        segments = self.segments()
+        while len(records) < max_records:
+            newer = [s for s in segments if s > segment_id]
+            if segment_id not in segments:
+                if not newer:
+                    break
+                segment_id, offset = newer[0], 0
+                continue
+            complete = self._read_segment(segment_id, offset, max_records - len(records), records)
+            if len(records) >= max_records:
+                break
+            if not complete and not newer:
+                # Aktif segment: yazılmakta olan kayıt için bir sonraki turu bekle
+                break
+            if not newer:
+                break
+            # Segment bitti (ya da kuyruğu yarım kaldı ve kapandı): sıradakine geç
+            segment_id, offset = newer[0], 0
+        next_position = records[-1][0] if records else (segment_id, offset)
+        return records, next_position
+
+    def _read_segment(self, segment_id: int, offset: int, limit: int, records: list) -> bool:
+        """Append up to limit valid records; returns False if the segment ends in a torn record"""
+        with open(self._segment_path(segment_id), "rb") as f:
+            f.seek(offset)
+            while limit > 0:
+                header = f.read(RECORD_HEADER.size)
+                if not header:
+                    return True
+                data = b""
+                if len(header) == RECORD_HEADER.size:
+                    length, crc = RECORD_HEADER.unpack(header)
+                    data = f.read(length)
+                if len(header) < RECORD_HEADER.size or len(data) < length or zlib.crc32(data) != crc:
+                    # Sonrasında geçerli kayıt yoksa yarım kuyruktur; varsa ortadaki bozuk kayıt atlanır
+                    resume = self._resync(f, offset)
+                    if resume is None:
+                        return False
+                    print(f"[retry_log] Skipped {resume - offset} corrupt bytes in segment {segment_id} at {offset}")
+                    offset = resume
+                    f.seek(offset)
+                    continue
+                offset += RECORD_HEADER.size + length
+                records.append(((segment_id, offset), json.loads(data)))
+                limit -= 1
+        return True
+
+    @staticmethod
+    def _resync(f, offset: int):
+        """Offset of the next valid record after a corrupt one at offset, or None if there is none"""
+        f.seek(offset + 1)
+        rest = f.read()
+        base = offset + 1
+        # Kayıtlar JSON nesnesidir: başlıktan sonra '{' gelen konumlar denenir
+        start = rest.find(b"{", RECORD_HEADER.size)
+        while start != -1:
+            candidate = start - RECORD_HEADER.size
+            length, crc = RECORD_HEADER.unpack_from(rest, candidate)
+            if length <= MAX_RECORD_BYTES and candidate + RECORD_HEADER.size + length <= len(rest):
+                if zlib.crc32(rest[start:start + length]) == crc:
+                    return base + candidate
+            start = rest.find(b"{", start + 1)
+        return None
+
+    def backlog_bytes(self) -> int:
+        """Bytes not yet replayed past the checkpoint"""
+        segment_id, offset = self.load_checkpoint()
+        total = 0
+        for sid in self.segments():
+            if sid < segment_id:
+                continue
+            size = os.path.getsize(self._segment_path(sid))
+            total += size - offset if sid == segment_id else size
+        return max(total, 0)
@@ -0,0 +1,182 @@
+import asyncio
+import datetime
+import os
+from databases import Database
+from dotenv import load_dotenv
+from crypto_utils import decrypt_vitals
+
+load_dotenv()
+
+DATABASE_URL = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+STATE_NAME = "vitals"
+BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "2000"))
+POLL_SECONDS = float(os.getenv("ROLLUP_POLL_SECONDS", "5"))
+# Commit sırası id sırasından farklı olabilir; en yeni satırlar bir süre bekletilir
+LAG_SECONDS = int(os.getenv("ROLLUP_LAG_SECONDS", "10"))
+
+BUCKETS = {
+    "minute": lambda ts: ts.replace(second=0, microsecond=0),
+    "hour": lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+}
+FIELDS = ("heart_rate", "oxygen_level", "temp")
+
+
+class Aggregate:
+    __slots__ = ("count", "mins", "maxs", "sums")
+
+    def __init__(self):
+        self.count = 0
+        self.mins = [None] * len(FIELDS)
+        self.maxs = [None] * len(FIELDS)
+        self.sums = [0] * len(FIELDS)
+
+    def add(self, values: tuple):
+        self.count += 1
+        for i, value in enumerate(values):
+            self.mins[i] = value if self.mins[i] is None else min(self.mins[i], value)
+            self.maxs[i] = value if self.maxs[i] is None else max(self.maxs[i], value)
+            self.sums[i] += value
+
+
+def packet_time(vitals: dict, row_time: datetime.datetime) -> datetime.datetime:
+    """Measurement time from the packet, falling back to the ingest time"""
+    try:
+        return datetime.datetime.fromisoformat(vitals["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        return row_time
+
+
+def field_values(vitals: dict):
+    """FIELDS values of a packet, or None when one is missing or not a number of the column's type"""
+    values = []
+    for field in FIELDS:
+        value = vitals.get(field)
+        # heart_rate ve oxygen_level INTEGER kolonlara yazılır; bool da int sayılmasın
+        allowed = (int, float) if field == "temp" else int
+        if isinstance(value, bool) or not isinstance(value, allowed):
+            return None
+        values.append(value)
+    return tuple(values)
+
+
+def aggregate_rows(rows) -> dict:
+    aggregates = {}
+    for row in rows:
+        try:
+            vitals = decrypt_vitals(row["envelope"] or row["encrypted_data"])
+        except Exception as e:
+            print(f"[rollup] Skipping packet {row['id']}: {e}")
+            continue
+        # Eksik ya da sayısal olmayan alanlı paket atlanır; aksi halde batch hiç ilerleyemez
+        values = field_values(vitals) if isinstance(vitals, dict) else None
+        if values is None:
+            print(f"[rollup] Skipping packet {row['id']}: missing or non-numeric vitals")
+            continue
+        ts = packet_time(vitals, row["time"])
+        for size, truncate in BUCKETS.items():
+            key = (row["patient_id"], size, truncate(ts))
+            if key not in aggregates:
+                aggregates[key] = Aggregate()
+            aggregates[key].add(values)
+    return aggregates
+
+
+# Kolon başına bir dizi parametresi: aggregate sayısı ne olursa olsun ifade 13 parametre taşır
+COLUMN_TYPES = {"patient_id": "varchar", "bucket_size": "varchar", "bucket": "timestamp", "sample_count": "integer"}
+for _field in FIELDS:
+    _value_type = "real" if _field == "temp" else "integer"
+    COLUMN_TYPES[f"{_field}_min"] = _value_type
+    COLUMN_TYPES[f"{_field}_max"] = _value_type
+    COLUMN_TYPES[f"{_field}_sum"] = "double precision" if _field == "temp" else "bigint"
+
+UPSERT_SQL = f"""
+    INSERT INTO vitals_rollup ({', '.join(COLUMN_TYPES)})
+    SELECT * FROM unnest({', '.join(f"CAST(:{column} AS {kind}[])" for column, kind in COLUMN_TYPES.items())})
+    ON CONFLICT (patient_id, bucket_size, bucket) DO UPDATE SET
+        sample_count = vitals_rollup.sample_count + EXCLUDED.sample_count,
+        {', '.join(
+            f"{field}_min = LEAST(vitals_rollup.{field}_min, EXCLUDED.{field}_min), "
+            f"{field}_max = GREATEST(vitals_rollup.{field}_max, EXCLUDED.{field}_max), "
+            f"{field}_sum = vitals_rollup.{field}_sum + EXCLUDED.{field}_sum"
+            for field in FIELDS
+        )}
+"""
+
+
+async def upsert_aggregates(db: Database, aggregates: dict):
+    values = {column: [] for column in COLUMN_TYPES}
+    for (patient_id, size, bucket), agg in aggregates.items():
+        values["patient_id"].append(patient_id)
+        values["bucket_size"].append(size)
+        values["bucket"].append(bucket)
+        values["sample_count"].append(agg.count)
+        for i, field in enumerate(FIELDS):
+            values[f"{field}_min"].append(agg.mins[i])
+            values[f"{field}_max"].append(agg.maxs[i])
+            values[f"{field}_sum"].append(agg.sums[i])
+    await db.execute(query=UPSERT_SQL, values=values)
+
+
+async def rollup_once(db: Database) -> int:
+    """Fold the next batch of packets into the rollup table; returns the number of packets consumed"""
+    async with db.transaction():
+        await db.execute(
+            "INSERT INTO rollup_state (name, last_id) VALUES (:name, 0) ON CONFLICT (name) DO NOTHING",
+            {"name": STATE_NAME}
+        )
+        # FOR UPDATE: aynı anda iki worker çalışsa bile her paket bir kez sayılır
+        state = await db.fetch_one(
+            "SELECT last_id FROM rollup_state WHERE name = :name FOR UPDATE", {"name": STATE_NAME}
+        )
+        rows = await db.fetch_all("""
+            SELECT id, patient_id, time, encrypted_data, envelope,
+                   time < NOW() - make_interval(secs => :lag) AS settled
+            FROM encrypted_vitals
+            WHERE id > :last_id
+            ORDER BY id
+            LIMIT :limit
+        """, {"last_id": state["last_id"], "lag": LAG_SECONDS, "limit": BATCH_SIZE})
+
+        # Sadece yerleşmiş satırlardan oluşan ön ek işlenir; yüksek su işareti geri dönmez
+        settled = []
+        for row in rows:
+            if not row["settled"]:
+                break
+            settled.append(row)
+        if not settled:
+            return 0
+
+        aggregates = aggregate_rows(settled)
+        if aggregates:
+            await upsert_aggregates(db, aggregates)
+        await db.execute(
+            "UPDATE rollup_state SET last_id = :last_id, updated_at = NOW() WHERE name = :name",
+            {"last_id": settled[-1]["id"], "name": STATE_NAME}
+        )
+        return len(settled)
+
+
+async def run_loop():
+    db = Database(DATABASE_URL)
+    await db.connect()
+    try:
+        while True:
+            try:
+                consumed = await rollup_once(db)
+                if consumed:
+                    print(f"[rollup] Aggregated {consumed} packets")
+            except Exception as e:
+                print(f"[rollup] Error: {e}")
+                consumed = 0
+            # Birikmiş iş varsa beklemeden devam et
+            if consumed < BATCH_SIZE:
+                await asyncio.sleep(POLL_SECONDS)
+    finally:
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_loop())
+    except KeyboardInterrupt:
+        print("Stopped rollup worker.")
@@ -1,7 +1,8 @@
 CREATE TABLE IF NOT EXISTS encrypted_vitals (
     id SERIAL PRIMARY KEY,
     patient_id VARCHAR(255),
-    encrypted_data TEXT NOT NULL,
+    encrypted_data TEXT,
+    envelope BYTEA,
     time TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
     uuid UUID NOT NULL UNIQUE,
     seq_no BIGINT,
@@ -10,6 +11,83 @@ CREATE TABLE IF NOT EXISTS encrypted_vitals (
     CONSTRAINT uniq_patient_seq UNIQUE (patient_id, seq_no)
 );
 
+-- v2 binary envelopes (version | nonce | tag | ciphertext) are stored in envelope,
+-- legacy base64 JSON envelopes stay in encrypted_data
+ALTER TABLE encrypted_vitals ADD COLUMN IF NOT EXISTS envelope BYTEA;
+ALTER TABLE encrypted_vitals ALTER COLUMN encrypted_data DROP NOT NULL;
+
+-- Keyset cursor reads: id > :after_id uses the primary key, (time, id) > (...) uses this index
+CREATE INDEX IF NOT EXISTS idx_encrypted_vitals_time_id ON encrypted_vitals(time, id);
+-- Per-patient "latest N" and time-window reads
+CREATE INDEX IF NOT EXISTS idx_encrypted_vitals_patient_time ON encrypted_vitals(patient_id, time DESC, id DESC);
+
+-- Duplicate detection keys (uuid and patient_id/seq_no) live outside encrypted_vitals,
+-- because unique indexes on a hypertable must include its time column
+CREATE TABLE IF NOT EXISTS packet_keys (
+    uuid UUID PRIMARY KEY,
+    patient_id VARCHAR(255),
+    seq_no BIGINT,
+    time TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+
+    CONSTRAINT uniq_packet_keys_patient_seq UNIQUE (patient_id, seq_no)
+);
+CREATE INDEX IF NOT EXISTS idx_packet_keys_time ON packet_keys(time);
+
+INSERT INTO packet_keys (uuid, patient_id, seq_no, time)
+SELECT uuid, patient_id, seq_no, COALESCE(time, now()) FROM encrypted_vitals
+ON CONFLICT DO NOTHING;
+
+-- On TimescaleDB, encrypted_vitals becomes a hypertable partitioned by time.
+-- Compression and archival/retention are configured by vitals_archive.py.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb') THEN
+        CREATE EXTENSION IF NOT EXISTS timescaledb;
+        IF NOT EXISTS (
+            SELECT 1 FROM timescaledb_information.hypertables WHERE hypertable_name = 'encrypted_vitals'
+        ) THEN
+            ALTER TABLE encrypted_vitals DROP CONSTRAINT IF EXISTS encrypted_vitals_uuid_key;
+            ALTER TABLE encrypted_vitals DROP CONSTRAINT IF EXISTS uniq_patient_seq;
+            ALTER TABLE encrypted_vitals DROP CONSTRAINT IF EXISTS encrypted_vitals_pkey;
+            ALTER TABLE encrypted_vitals ALTER COLUMN time SET NOT NULL;
+            ALTER TABLE encrypted_vitals ADD PRIMARY KEY (id, time);
+            PERFORM create_hypertable('encrypted_vitals', 'time',
+                chunk_time_interval => INTERVAL '1 day', migrate_data => true);
+            ALTER TABLE encrypted_vitals SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'patient_id',
+                timescaledb.compress_orderby = 'time DESC, id DESC'
+            );
+        END IF;
+    END IF;
+END $$;
+
+-- Without the unique constraints (hypertable case) uuid and (patient_id, seq_no) lookups
+-- (NOTIFY fallback, /vitals/decrypted, seq range reads) still need plain indexes to avoid
+-- scanning every chunk; de-duplication itself is enforced by packet_keys
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'encrypted_vitals_uuid_key') THEN
+        CREATE INDEX IF NOT EXISTS idx_encrypted_vitals_uuid ON encrypted_vitals(uuid);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uniq_patient_seq') THEN
+        CREATE INDEX IF NOT EXISTS idx_encrypted_vitals_patient_seq ON encrypted_vitals(patient_id, seq_no);
+    END IF;
+END $$;
+
+-- Plaintext vitals written by /write
+CREATE TABLE IF NOT EXISTS vitals (
+    id BIGSERIAL PRIMARY KEY,
+    patient_id VARCHAR(255),
+    time TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+    heart_rate INTEGER,
+    oxygen_level INTEGER,
+    temp REAL
+);
+ALTER TABLE vitals ADD COLUMN IF NOT EXISTS id BIGSERIAL;
+CREATE INDEX IF NOT EXISTS idx_vitals_time_id ON vitals(time, id);
+CREATE INDEX IF NOT EXISTS idx_vitals_id ON vitals(id);
+
 
 -- Users table for login system
 CREATE TABLE IF NOT EXISTS users (
@@ -42,6 +120,27 @@ ON CONFLICT (email) DO UPDATE SET
     last_name = EXCLUDED.last_name,
     assigned_patients = EXCLUDED.assigned_patients;
 
+-- Caregiver <-> patient assignments (replaces parsing users.assigned_patients, which is kept in sync)
+CREATE TABLE IF NOT EXISTS caregiver_patients (
+    caregiver_id INTEGER NOT NULL,
+    patient_id INTEGER NOT NULL,
+    assigned_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+
+    PRIMARY KEY (caregiver_id, patient_id),
+    FOREIGN KEY (caregiver_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (patient_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_caregiver_patients_patient ON caregiver_patients(patient_id, caregiver_id);
+
+-- Backfill from the legacy comma-separated column
+INSERT INTO caregiver_patients (caregiver_id, patient_id)
+SELECT c.id, p.id
+FROM users c
+CROSS JOIN LATERAL unnest(string_to_array(c.assigned_patients, ',')) AS a(patient_id)
+JOIN users p ON p.id::text = trim(a.patient_id)
+WHERE c.role = 'caregiver' AND c.assigned_patients IS NOT NULL
+ON CONFLICT DO NOTHING;
+
 
   CREATE TABLE IF NOT EXISTS caregiver_notes (
       id SERIAL PRIMARY KEY,
@@ -58,10 +157,23 @@ ON CONFLICT (email) DO UPDATE SET
   );
 
   -- Index for performance
-  CREATE INDEX IF NOT EXISTS idx_caregiver_notes_patient_id ON caregiver_notes(patient_id);
-  CREATE INDEX IF NOT EXISTS idx_caregiver_notes_caregiver_id ON caregiver_notes(caregiver_id);
-  CREATE INDEX IF NOT EXISTS idx_caregiver_notes_care_level ON caregiver_notes(care_level);
-  CREATE INDEX IF NOT EXISTS idx_caregiver_notes_created_at ON caregiver_notes(created_at DESC);
+  -- Note listings page over (created_at, id); each filter has a matching composite index
+  CREATE INDEX IF NOT EXISTS idx_caregiver_notes_patient_page ON caregiver_notes(patient_id, created_at DESC, id DESC);
+  CREATE INDEX IF NOT EXISTS idx_caregiver_notes_caregiver_page ON caregiver_notes(caregiver_id, created_at DESC, id DESC);
+  CREATE INDEX IF NOT EXISTS idx_caregiver_notes_care_level_page ON caregiver_notes(care_level, created_at DESC, id DESC);
+  CREATE INDEX IF NOT EXISTS idx_caregiver_notes_page ON caregiver_notes(created_at DESC, id DESC);
+  DROP INDEX IF EXISTS idx_caregiver_notes_patient_id;
+  DROP INDEX IF EXISTS idx_caregiver_notes_caregiver_id;
+  DROP INDEX IF EXISTS idx_caregiver_notes_care_level;
+  DROP INDEX IF EXISTS idx_caregiver_notes_created_at;
+
+  -- Full-text search; 'simple' keeps Turkish and English words unstemmed
+  ALTER TABLE caregiver_notes ADD COLUMN IF NOT EXISTS search_vector tsvector
+      GENERATED ALWAYS AS (
+          setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+          setweight(to_tsvector('simple', coalesce(content, '')), 'B')
+      ) STORED;
+  CREATE INDEX IF NOT EXISTS idx_caregiver_notes_search ON caregiver_notes USING GIN (search_vector);
 
 -- Critical alerts table for heart rate notifications
 CREATE TABLE IF NOT EXISTS critical_alerts (
@@ -82,9 +194,22 @@ CREATE TABLE IF NOT EXISTS critical_alerts (
 -- Index for performance
 CREATE INDEX IF NOT EXISTS idx_critical_alerts_caregiver_id ON critical_alerts(caregiver_id);
 CREATE INDEX IF NOT EXISTS idx_critical_alerts_patient_id ON critical_alerts(patient_id);
-CREATE INDEX IF NOT EXISTS idx_critical_alerts_is_read ON critical_alerts(is_read);
+-- Unread alerts are a small, selective subset: index only those rows
+CREATE INDEX IF NOT EXISTS idx_critical_alerts_unread
+    ON critical_alerts(caregiver_id, created_at DESC)
+    WHERE is_read = false;
+DROP INDEX IF EXISTS idx_critical_alerts_is_read;
 CREATE INDEX IF NOT EXISTS idx_critical_alerts_created_at ON critical_alerts(created_at DESC);
 
+-- Repeated unread alerts for the same patient/type are coalesced into one row
+ALTER TABLE critical_alerts ADD COLUMN IF NOT EXISTS occurrence_count INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE critical_alerts ADD COLUMN IF NOT EXISTS last_seen_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now();
+CREATE INDEX IF NOT EXISTS idx_critical_alerts_coalesce
+    ON critical_alerts(patient_id, alert_type, caregiver_id, last_seen_at DESC)
+    WHERE is_read = false;
+-- Temperature thresholds are fractional (38.5 °C)
+ALTER TABLE critical_alerts ALTER COLUMN threshold_value TYPE REAL;
+
 -- Doctor feedback table for caregiver notes
 CREATE TABLE IF NOT EXISTS doctor_feedback (
     id SERIAL PRIMARY KEY,
@@ -122,9 +247,99 @@ CREATE TABLE IF NOT EXISTS chat_messages (
 );
 
 -- Index for performance
-CREATE INDEX IF NOT EXISTS idx_chat_messages_note_id ON chat_messages(note_id);
+-- Incremental chat sync reads (note_id, id > after_message_id)
+CREATE INDEX IF NOT EXISTS idx_chat_messages_note_id_id ON chat_messages(note_id, id);
+DROP INDEX IF EXISTS idx_chat_messages_note_id;
 CREATE INDEX IF NOT EXISTS idx_chat_messages_sender_id ON chat_messages(sender_id);
-CREATE INDEX IF NOT EXISTS idx_chat_messages_is_read ON chat_messages(is_read);
+DROP INDEX IF EXISTS idx_chat_messages_is_read;
 CREATE INDEX IF NOT EXISTS idx_chat_messages_created_at ON chat_messages(created_at ASC);
 
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED;
+CREATE INDEX IF NOT EXISTS idx_chat_messages_search ON chat_messages USING GIN (search_vector);
+
+-- Per-user read watermark per note chat; replaces per-row is_read updates
+CREATE TABLE IF NOT EXISTS chat_read_state (
+    note_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    last_read_message_id INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+
+    PRIMARY KEY (note_id, user_id),
+    FOREIGN KEY (note_id) REFERENCES caregiver_notes(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Backfill from the legacy is_read flags: the note's caregiver and every sender have read
+-- up to the newest message from someone else that was already marked read
+INSERT INTO chat_read_state (note_id, user_id, last_read_message_id)
+SELECT p.note_id, p.user_id, MAX(cm.id)
+FROM (
+    SELECT id AS note_id, caregiver_id AS user_id FROM caregiver_notes
+    UNION
+    SELECT note_id, sender_id FROM chat_messages
+) p
+JOIN chat_messages cm ON cm.note_id = p.note_id AND cm.sender_id <> p.user_id AND cm.is_read
+GROUP BY p.note_id, p.user_id
+ON CONFLICT DO NOTHING;
 
+-- Per-user unread counters ('chat', 'alert'), kept in step with every insert and read by the API
+CREATE TABLE IF NOT EXISTS unread_counters (
+    user_id INTEGER NOT NULL,
+    kind VARCHAR(10) NOT NULL CHECK (kind IN ('chat', 'alert')),
+    count INTEGER NOT NULL DEFAULT 0,
+
+    PRIMARY KEY (user_id, kind),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Backfill: caregivers count others' messages on their notes, doctors count caregiver messages,
+-- both past their read watermark; alerts count unread rows
+INSERT INTO unread_counters (user_id, kind, count)
+SELECT u.id, 'chat', COUNT(cm.id)
+FROM users u
+JOIN chat_messages cm
+  ON cm.sender_id <> u.id
+ AND (
+     (u.role = 'caregiver' AND cm.note_id IN (SELECT id FROM caregiver_notes WHERE caregiver_id = u.id))
+  OR (u.role = 'doctor' AND cm.sender_role = 'caregiver')
+ )
+LEFT JOIN chat_read_state rs ON rs.note_id = cm.note_id AND rs.user_id = u.id
+WHERE cm.id > COALESCE(rs.last_read_message_id, 0)
+GROUP BY u.id
+ON CONFLICT DO NOTHING;
+
+INSERT INTO unread_counters (user_id, kind, count)
+SELECT caregiver_id, 'alert', COUNT(*)
+FROM critical_alerts
+WHERE is_read = false
+GROUP BY caregiver_id
+ON CONFLICT DO NOTHING;
+
+
+
+-- Per-patient per-minute / per-hour vitals aggregates maintained by rollup_worker.py
+CREATE TABLE IF NOT EXISTS vitals_rollup (
+    patient_id VARCHAR(255) NOT NULL,
+    bucket_size VARCHAR(10) NOT NULL CHECK (bucket_size IN ('minute', 'hour')),
+    bucket TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    sample_count INTEGER NOT NULL,
+    heart_rate_min INTEGER,
+    heart_rate_max INTEGER,
+    heart_rate_sum BIGINT,
+    oxygen_level_min INTEGER,
+    oxygen_level_max INTEGER,
+    oxygen_level_sum BIGINT,
+    temp_min REAL,
+    temp_max REAL,
+    temp_sum DOUBLE PRECISION,
+
+    PRIMARY KEY (patient_id, bucket_size, bucket)
+);
+
+-- High-water mark (last encrypted_vitals.id folded into the rollups)
+CREATE TABLE IF NOT EXISTS rollup_state (
+    name VARCHAR(50) PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now()
+);
@@ -0,0 +1,47 @@
+from alert_detector import ThresholdDetector, ThresholdRule
+
+HEART_RATE = ThresholdRule("heart_rate", "critical_heart_rate", low=50, high=120, clear_margin=5)
+
+
+def fired_types(detector, heart_rate, now, patient_id="1"):
+    return [rule.alert_type for rule, _ in detector.observe(patient_id, {"heart_rate": heart_rate}, now=now)]
+
+
+def test_breach_fires_once_while_it_lasts():
+    detector = ThresholdDetector(rules=[HEART_RATE], cooldown_seconds=0)
+    assert fired_types(detector, 130, now=0) == ["critical_heart_rate"]
+    assert fired_types(detector, 135, now=1) == []
+    assert fired_types(detector, 125, now=2) == []
+
+
+def test_value_inside_clear_margin_does_not_rearm():
+    detector = ThresholdDetector(rules=[HEART_RATE], cooldown_seconds=0)
+    assert fired_types(detector, 130, now=0) == ["critical_heart_rate"]
+    # 118 eşiğin altında ama clear_margin içinde: alarm hâlâ aktif
+    assert fired_types(detector, 118, now=1) == []
+    assert fired_types(detector, 130, now=2) == []
+
+
+def test_clearing_past_margin_rearms_the_rule():
+    detector = ThresholdDetector(rules=[HEART_RATE], cooldown_seconds=0)
+    assert fired_types(detector, 130, now=0) == ["critical_heart_rate"]
+    assert fired_types(detector, 110, now=1) == []
+    assert fired_types(detector, 130, now=2) == ["critical_heart_rate"]
+
+
+def test_cooldown_suppresses_a_quick_refire():
+    detector = ThresholdDetector(rules=[HEART_RATE], cooldown_seconds=60)
+    assert fired_types(detector, 130, now=0) == ["critical_heart_rate"]
+    assert fired_types(detector, 100, now=10) == []
+    assert fired_types(detector, 130, now=20) == []
+    assert fired_types(detector, 100, now=30) == []
+    assert fired_types(detector, 130, now=70) == ["critical_heart_rate"]
+
+
+def test_low_side_and_patients_are_tracked_separately():
+    detector = ThresholdDetector(rules=[HEART_RATE], cooldown_seconds=0)
+    assert fired_types(detector, 40, now=0, patient_id="1") == ["critical_heart_rate"]
+    assert fired_types(detector, 40, now=0, patient_id="2") == ["critical_heart_rate"]
+    assert fired_types(detector, 53, now=1, patient_id="1") == []
+    assert fired_types(detector, 40, now=2, patient_id="1") == []
+    assert detector.stats()["alerts_fired"] == 2
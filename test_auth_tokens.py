@@ -0,0 +1,69 @@
+import hashlib
+import hmac
+import json
+import time
+
+import pytest
+
+from auth_tokens import KeyRing, TokenError, _b64encode, issue_token, verify_token
+
+
+@pytest.fixture
+def keyring():
+    return KeyRing(secret="test-secret")
+
+
+def sign(keyring, header: dict, payload: dict) -> str:
+    """A token with an arbitrary header and payload, validly signed with the active key"""
+    _, key = keyring.active()
+    signing_input = (
+        _b64encode(json.dumps(header).encode("utf-8")) + "." + _b64encode(json.dumps(payload).encode("utf-8"))
+    )
+    signature = hmac.new(key, signing_input.encode("ascii"), hashlib.sha256).digest()
+    return signing_input + "." + _b64encode(signature)
+
+
+def test_issued_token_verifies(keyring):
+    token, exp = issue_token(keyring, {"sub": "5", "role": "doctor"}, 60)
+    claims = verify_token(keyring, token)
+    assert claims["sub"] == "5" and claims["role"] == "doctor"
+    assert claims["exp"] == exp
+
+
+def test_expired_token_is_rejected(keyring):
+    token, _ = issue_token(keyring, {"sub": "5", "role": "doctor"}, -1)
+    with pytest.raises(TokenError, match="expired"):
+        verify_token(keyring, token)
+
+
+def test_token_signed_with_another_key_is_rejected(keyring):
+    token, _ = issue_token(KeyRing(secret="other-secret"), {"sub": "5", "role": "doctor"}, 60)
+    with pytest.raises(TokenError, match="signature"):
+        verify_token(keyring, token)
+
+
+def test_tampered_payload_is_rejected(keyring):
+    token, _ = issue_token(keyring, {"sub": "5", "role": "caregiver"}, 60)
+    header_b64, _, signature_b64 = token.split(".")
+    forged = _b64encode(json.dumps({"sub": "5", "role": "doctor", "exp": time.time() + 60}).encode("utf-8"))
+    with pytest.raises(TokenError):
+        verify_token(keyring, f"{header_b64}.{forged}.{signature_b64}")
+
+
+@pytest.mark.parametrize("token", ["", "a.b", "not.base64!.token", "é.é.é"])
+def test_malformed_token_is_rejected(keyring, token):
+    with pytest.raises(TokenError):
+        verify_token(keyring, token)
+
+
+def test_non_string_kid_is_rejected(keyring):
+    token = sign(keyring, {"alg": "HS256", "kid": ["default"]}, {"exp": time.time() + 60})
+    with pytest.raises(TokenError):
+        verify_token(keyring, token)
+
+
+@pytest.mark.parametrize("exp", [None, "9999999999", True])
+def test_non_numeric_exp_is_rejected(keyring, exp):
+    token = sign(keyring, {"alg": "HS256", "kid": "default"}, {"sub": "5", "exp": exp})
+    with pytest.raises(TokenError):
+        verify_token(keyring, token)
@@ -0,0 +1,53 @@
+import base64
+import json
+
+import pytest
+
+from crypto_utils import (
+    ENVELOPE_V2, decrypt_data, decrypt_vitals, encrypt_data, encrypt_packet, envelope_version
+)
+
+PACKET = {
+    "uuid": "0f8fad5b-d9cb-469f-a165-70867728950e",
+    "seq_no": 42,
+    "patient_id": "7",
+    "heart_rate": 88,
+    "oxygen_level": 97,
+    "temp": 36.8,
+    "timestamp": "2026-01-01T12:30:45.123456"
+}
+
+
+def padded(packet: dict) -> bytes:
+    data = json.dumps(packet).encode("utf-8")
+    return data + b"X" * (5120 - len(data))
+
+
+def test_v1_envelope_round_trip():
+    envelope = encrypt_data(padded(PACKET))
+    assert envelope_version(envelope) == 1
+    assert decrypt_vitals(envelope) == PACKET
+    assert decrypt_vitals(envelope.encode("utf-8")) == PACKET
+
+
+def test_v2_envelope_round_trip():
+    envelope = encrypt_packet(PACKET)
+    assert envelope[0] == ENVELOPE_V2
+    assert envelope_version(envelope) == ENVELOPE_V2
+    assert decrypt_vitals(envelope) == PACKET
+    # /write_encrypted istemcileri base64 metin gönderir
+    text = base64.b64encode(envelope).decode("ascii")
+    assert envelope_version(text) == ENVELOPE_V2
+    assert decrypt_vitals(text) == PACKET
+    assert json.loads(decrypt_data(text)) == PACKET
+
+
+def test_v2_envelopes_use_fresh_nonces():
+    assert encrypt_packet(PACKET) != encrypt_packet(PACKET)
+
+
+def test_v2_tampered_ciphertext_is_rejected():
+    envelope = bytearray(encrypt_packet(PACKET))
+    envelope[-1] ^= 0x01
+    with pytest.raises(ValueError):
+        decrypt_vitals(bytes(envelope))
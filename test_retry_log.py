@@ -0,0 +1,87 @@
+import os
+
+from retry_log import RECORD_HEADER, RetryLog
+
+
+def write_records(directory, payloads):
+    log = RetryLog(str(directory))
+    for payload in payloads:
+        log.append(payload)
+    log.close()
+    return log
+
+
+def test_records_read_back_in_order(tmp_path):
+    log = write_records(tmp_path, [{"seq_no": n} for n in range(5)])
+    records, position = log.read(10)
+    assert [payload["seq_no"] for _, payload in records] == [0, 1, 2, 3, 4]
+    assert position == records[-1][0]
+
+
+def test_torn_tail_of_active_segment_is_not_returned(tmp_path):
+    log = write_records(tmp_path, [{"seq_no": 0}, {"seq_no": 1}])
+    path = log._segment_path(log.segments()[-1])
+    # Yazma sırasında çökme: son kaydın sadece bir kısmı diske ulaştı
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+
+    records, position = log.read(10)
+    assert [payload["seq_no"] for _, payload in records] == [0]
+    assert position == records[0][0]
+
+
+def test_torn_tail_of_older_segment_is_skipped_after_restart(tmp_path):
+    log = write_records(tmp_path, [{"seq_no": 0}, {"seq_no": 1}])
+    path = log._segment_path(log.segments()[-1])
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+    # Yeniden başlatılan yazar yeni bir segment açar
+    write_records(tmp_path, [{"seq_no": 2}])
+
+    records, _ = RetryLog(str(tmp_path)).read(10)
+    assert [payload["seq_no"] for _, payload in records] == [0, 2]
+
+
+def test_corrupt_record_stops_reading_the_segment(tmp_path):
+    log = write_records(tmp_path, [{"seq_no": 0}, {"seq_no": 1}])
+    path = log._segment_path(log.segments()[-1])
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+    records, _ = log.read(10)
+    assert [payload["seq_no"] for _, payload in records] == [0]
+
+
+def test_corrupt_record_mid_segment_is_skipped_without_losing_later_records(tmp_path):
+    log = write_records(tmp_path, [{"seq_no": 0}, {"seq_no": 1}, {"seq_no": 2}])
+    path = log._segment_path(log.segments()[-1])
+    first_length = os.path.getsize(path) // 3
+    # Ortadaki kaydın payload'ı bozulur; sonraki onaylanmış kayıt kaybolmamalı
+    with open(path, "r+b") as f:
+        f.seek(first_length + RECORD_HEADER.size + 2)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    records, position = log.read(10)
+    assert [payload["seq_no"] for _, payload in records] == [0, 2]
+    assert position == (log.segments()[-1], os.path.getsize(path))
+
+
+def test_commit_resumes_after_checkpoint_and_drops_replayed_segments(tmp_path):
+    log = RetryLog(str(tmp_path), segment_bytes=RECORD_HEADER.size + 1)
+    for n in range(3):
+        log.append({"seq_no": n})
+    log.close()
+    assert len(log.segments()) >= 3
+
+    records, position = log.read(2)
+    log.commit(position)
+
+    reader = RetryLog(str(tmp_path))
+    assert reader.segments()[0] == position[0]
+    records, _ = reader.read(10)
+    assert [payload["seq_no"] for _, payload in records] == [2]
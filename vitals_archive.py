@@ -0,0 +1,192 @@
+import asyncio
+import datetime
+import glob
+import gzip
+import json
+import os
+from databases import Database
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATABASE_URL = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+ARCHIVE_DIR = os.getenv("VITALS_ARCHIVE_DIR", "archive")
+# Bu yaştan eski veriler arşive yazılıp tablodan silinir
+RETENTION_DAYS = int(os.getenv("VITALS_RETENTION_DAYS", "30"))
+# Bu yaştan eski chunk'lar Timescale tarafından sıkıştırılır (0: kapalı)
+COMPRESS_AFTER_DAYS = int(os.getenv("VITALS_COMPRESS_AFTER_DAYS", "7"))
+CHUNK_HOURS = int(os.getenv("VITALS_CHUNK_HOURS", "24"))
+RUN_EVERY_SECONDS = int(os.getenv("VITALS_ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+FILE_PREFIX = "encrypted_vitals_"
+FILE_SUFFIX = ".jsonl.gz"
+TIME_FORMAT = "%Y%m%dT%H%M%S"
+
+EXPORT_QUERY = """
+    SELECT id, uuid, seq_no, patient_id,
+           COALESCE(encrypted_data, replace(encode(envelope, 'base64'), chr(10), '')) AS encrypted_data,
+           time, late
+    FROM encrypted_vitals
+    WHERE time >= :range_start AND time < :range_end
+    ORDER BY time, id
+"""
+
+
+def archive_path(range_start: datetime.datetime, range_end: datetime.datetime) -> str:
+    name = f"{FILE_PREFIX}{range_start.strftime(TIME_FORMAT)}_{range_end.strftime(TIME_FORMAT)}{FILE_SUFFIX}"
+    return os.path.join(ARCHIVE_DIR, name)
+
+
+def archive_ranges_on_disk():
+    """Yield (range_start, range_end, path) for every archive file, oldest first"""
+    for path in sorted(glob.glob(os.path.join(ARCHIVE_DIR, f"{FILE_PREFIX}*{FILE_SUFFIX}"))):
+        name = os.path.basename(path)[len(FILE_PREFIX):-len(FILE_SUFFIX)]
+        try:
+            start, end = (datetime.datetime.strptime(part, TIME_FORMAT) for part in name.split("_"))
+        except ValueError:
+            continue
+        yield start, end, path
+
+
+def _naive_utc(value):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def read_archive(patient_id=None, start=None, end=None, limit=100) -> list:
+    """Read archived rows, pruning files by the time range encoded in their names"""
+    start, end = _naive_utc(start), _naive_utc(end)
+    rows = []
+    for range_start, range_end, path in archive_ranges_on_disk():
+        if (start and range_end <= start) or (end and range_start > end):
+            continue
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if patient_id is not None and row["patient_id"] != patient_id:
+                    continue
+                row_time = datetime.datetime.fromisoformat(row["time"])
+                if (start and row_time < start) or (end and row_time > end):
+                    continue
+                rows.append(row)
+                if len(rows) >= limit:
+                    return rows
+    return rows
+
+
+async def is_hypertable(db: Database) -> bool:
+    row = await db.fetch_one("""
+        SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'timescaledb') AS installed
+    """)
+    if not row["installed"]:
+        return False
+    row = await db.fetch_one("""
+        SELECT EXISTS (
+            SELECT 1 FROM timescaledb_information.hypertables WHERE hypertable_name = 'encrypted_vitals'
+        ) AS hypertable
+    """)
+    return row["hypertable"]
+
+
+async def apply_policies(db: Database):
+    """Apply the configured chunk interval and compression policy to the hypertable"""
+    await db.execute(
+        "SELECT set_chunk_time_interval('encrypted_vitals', make_interval(hours => :hours))",
+        {"hours": CHUNK_HOURS}
+    )
+    await db.execute("SELECT remove_compression_policy('encrypted_vitals', if_exists => true)")
+    if COMPRESS_AFTER_DAYS > 0:
+        await db.execute(
+            "SELECT add_compression_policy('encrypted_vitals', make_interval(days => :days))",
+            {"days": COMPRESS_AFTER_DAYS}
+        )
+
+
+async def expired_ranges(db: Database, hypertable: bool, cutoff: datetime.datetime) -> list:
+    """Time ranges entirely older than the cutoff: whole chunks, or whole days for a plain table"""
+    if hypertable:
+        rows = await db.fetch_all("""
+            SELECT range_start, range_end FROM timescaledb_information.chunks
+            WHERE hypertable_name = 'encrypted_vitals' AND range_end <= :cutoff
+            ORDER BY range_start
+        """, {"cutoff": cutoff})
+        return [(row["range_start"].replace(tzinfo=None), row["range_end"].replace(tzinfo=None)) for row in rows]
+
+    row = await db.fetch_one("SELECT MIN(time) AS oldest FROM encrypted_vitals")
+    if not row or row["oldest"] is None:
+        return []
+    ranges = []
+    day = row["oldest"].replace(hour=0, minute=0, second=0, microsecond=0)
+    while day + datetime.timedelta(days=1) <= cutoff:
+        ranges.append((day, day + datetime.timedelta(days=1)))
+        day += datetime.timedelta(days=1)
+    return ranges
+
+
+async def export_range(db: Database, range_start, range_end) -> int:
+    """Write one range to a gzip JSONL file; the file only appears once it is complete"""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(range_start, range_end)
+    tmp_path = path + ".tmp"
+    count = 0
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        async for row in db.iterate(EXPORT_QUERY, {"range_start": range_start, "range_end": range_end}):
+            record = dict(row)
+            record["uuid"] = str(record["uuid"])
+            record["time"] = record["time"].isoformat()
+            f.write(json.dumps(record) + "\n")
+            count += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+async def drop_range(db: Database, hypertable: bool, range_start, range_end):
+    if hypertable:
+        await db.execute(
+            "SELECT drop_chunks('encrypted_vitals', older_than => :range_end, newer_than => :range_start)",
+            {"range_start": range_start, "range_end": range_end}
+        )
+    else:
+        await db.execute(
+            "DELETE FROM encrypted_vitals WHERE time >= :range_start AND time < :range_end",
+            {"range_start": range_start, "range_end": range_end}
+        )
+
+
+async def archive_once(db: Database):
+    hypertable = await is_hypertable(db)
+    if hypertable:
+        await apply_policies(db)
+
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=RETENTION_DAYS)
+    for range_start, range_end in await expired_ranges(db, hypertable, cutoff):
+        count = await export_range(db, range_start, range_end)
+        await drop_range(db, hypertable, range_start, range_end)
+        print(f"[archive] {range_start} - {range_end}: {count} packets archived")
+
+    # Tekrar anahtarları da aynı süre tutulur
+    await db.execute("DELETE FROM packet_keys WHERE time < :cutoff", {"cutoff": cutoff})
+
+
+async def run_loop():
+    db = Database(DATABASE_URL)
+    await db.connect()
+    try:
+        while True:
+            try:
+                await archive_once(db)
+            except Exception as e:
+                print(f"[archive] Error: {e}")
+            await asyncio.sleep(RUN_EVERY_SECONDS)
+    finally:
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_loop())
+    except KeyboardInterrupt:
+        print("Stopped archiver.")
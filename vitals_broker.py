@@ -0,0 +1,48 @@
+import asyncio
+
+# Yavaş tüketiciye iletilen son olay: abonelik düşürüldü
+SHED = None
+
+
+class Broker:
+    """In-process pub/sub; a subscriber whose queue fills up is shed instead of blocking publishers"""
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.published = 0
+        self.shed = 0
+        self._subscribers = {}
+
+    def subscribe(self, topic: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(topic, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, topic: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(topic)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[topic]
+
+    def publish(self, topic: str, event):
+        self.published += 1
+        for queue in list(self._subscribers.get(topic, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Kuyruğu boşalt ve SHED gönder; tüketici bağlantıyı kapatır
+                self.unsubscribe(topic, queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(SHED)
+                self.shed += 1
+
+    def stats(self) -> dict:
+        return {
+            "topics": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "published": self.published,
+            "shed": self.shed
+        }